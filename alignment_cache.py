@@ -0,0 +1,186 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import tempfile
+import threading
+from functools import lru_cache
+
+import common as com
+
+logger = com.get_logger(__name__)
+
+# the shared cache is opt in: get_cache() only creates one when ALIGNMENT_CACHE_DIR is set or after configure()
+ENV_DIR = os.environ.get("ALIGNMENT_CACHE_DIR")
+DEFAULT_DIR = ENV_DIR or os.path.join(os.path.expanduser("~"), ".cache", "mfa_alignments")
+DEFAULT_MAX_BYTES = int(os.environ.get("ALIGNMENT_CACHE_BYTES", 512*1024**2))
+# bump when the post processing of mfa_output changes, so older entries stop matching
+FORMAT_VERSION = 2
+
+# digests of the most recently hashed audio files
+DIGEST_CACHE_SIZE = int(os.environ.get("ALIGNMENT_CACHE_DIGESTS", 4096))
+
+
+@lru_cache(maxsize=DIGEST_CACHE_SIZE)
+def _hash_file(path: str, mtime_ns: int, size: int):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1<<20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _file_digest(path: str):
+    # hashing the audio dominates a cache hit, so digests are kept until the file changes
+    st = os.stat(path)
+    return _hash_file(os.fspath(path), st.st_mtime_ns, st.st_size)
+
+
+def cache_key(voice_path: str, transcript: str, language: str, align_options: dict, model_version: str):
+    """
+    Content address of an alignment: the audio bytes, transcript, language, aligner options and
+    model version. File names and timestamps do not take part, so copies of a clip share an entry.
+    """
+    h = hashlib.sha256()
+    h.update(_file_digest(voice_path).encode())
+    h.update(json.dumps([transcript, language.lower(), align_options, model_version, FORMAT_VERSION],
+                        sort_keys=True, default=str).encode())
+    return h.hexdigest()
+
+
+class AlignmentCache:
+    """
+    On disk cache of mfa_output dicts by content address. Each entry is a json file under
+    cache_dir, and an SQLite index in WAL mode tracks sizes and last access for LRU eviction
+    once the entries exceed max_bytes. Files are written to a temporary name and renamed, so
+    several worker processes can share one cache_dir.
+    """
+    def __init__(self, cache_dir: str = DEFAULT_DIR, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = None
+        self._db_pid = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _conn(self):
+        # sqlite connections must not be shared with forked children
+        if self._db is None or self._db_pid!=os.getpid():
+            self._db = sqlite3.connect(os.path.join(self.cache_dir, "index.sqlite"), timeout=30,
+                                       check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, size INTEGER, last_access REAL)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access)")
+            self._db_pid = os.getpid()
+        return self._db
+
+    def _path(self, key: str):
+        return os.path.join(self.cache_dir, key[:2], key+".json")
+
+    def get(self, key: str):
+        with self._lock:
+            db = self._conn()
+            if db.execute("SELECT 1 FROM entries WHERE key=?", (key,)).fetchone():
+                try:
+                    with open(self._path(key), encoding="utf-8") as f:
+                        value = json.load(f)
+                except (FileNotFoundError, ValueError):
+                    # evicted or replaced by another process between the lookup and the read
+                    db.execute("DELETE FROM entries WHERE key=?", (key,))
+                else:
+                    db.execute("UPDATE entries SET last_access=? WHERE key=?", (time.time(), key))
+                    self.hits += 1
+                    return value
+            self.misses += 1
+        return None
+
+    def put(self, key: str, value: dict):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = json.dumps(value).encode("utf-8")
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+        with self._lock:
+            db = self._conn()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                db.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?)", (key, len(data), time.time()))
+                self._evict(db, keep=key)
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+        return value
+
+    def _evict(self, db, keep: str):
+        total = db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total<=self.max_bytes:
+            return
+        for key, size in db.execute("SELECT key, size FROM entries WHERE key!=? ORDER BY last_access", (keep,)).fetchall():
+            if total<=self.max_bytes:
+                break
+            db.execute("DELETE FROM entries WHERE key=?", (key,))
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+            total -= size
+            self.evictions += 1
+
+    def get_or_compute(self, key: str, compute):
+        value = self.get(key)
+        if value is None:
+            value = self.put(key, compute())
+        return value
+
+    def stats(self):
+        with self._lock:
+            entries, size = self._conn().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        lookups = self.hits+self.misses
+        return {
+            "entries": entries,
+            "bytes": size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits/lookups, 4) if lookups else 0.0,
+        }
+
+    def clear(self):
+        with self._lock:
+            db = self._conn()
+            for (key,) in db.execute("SELECT key FROM entries").fetchall():
+                try:
+                    os.remove(self._path(key))
+                except FileNotFoundError:
+                    pass
+            db.execute("DELETE FROM entries")
+            self.hits = self.misses = self.evictions = 0
+
+
+_cache = None
+
+
+def get_cache():
+    """
+    The process wide cache, or None when caching was not enabled through ALIGNMENT_CACHE_DIR or configure().
+    """
+    global _cache
+    if _cache is None and ENV_DIR:
+        _cache = AlignmentCache(ENV_DIR, DEFAULT_MAX_BYTES)
+    return _cache
+
+
+def configure(cache_dir: str = DEFAULT_DIR, max_bytes: int = DEFAULT_MAX_BYTES):
+    global _cache
+    _cache = AlignmentCache(cache_dir, max_bytes)
+    logger.info(f"alignment cache in {cache_dir}, up to {max_bytes} bytes")
+    return _cache
@@ -0,0 +1,265 @@
+import os
+import sys
+import time
+import asyncio
+import threading
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+
+import common as com
+import audio_io
+import metrics
+import mms_models
+from multilingual import Mfa_output, batch_emissions
+from frames_integrate import Frames, FramesBatch, phoneme_rows
+
+logger = com.get_logger(__name__)
+
+# latencies and batch sizes kept for stats(), the most recent ones
+STATS_WINDOW = int(os.environ.get("ALIGNMENT_SERVICE_STATS_WINDOW", 10000))
+
+
+def percentile(values: list, q: float):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    return values[min(len(values)-1, int(round(q/100*(len(values)-1))))]
+
+
+class _Job:
+    __slots__ = ("audio", "transcript", "language", "profile", "future", "submitted")
+
+    def __init__(self, audio, transcript: str, language: str, profile, future):
+        self.audio = audio
+        self.transcript = transcript
+        self.language = language
+        self.profile = profile
+        self.future = future
+        self.submitted = time.perf_counter()
+
+
+class AlignmentService:
+    """
+    asyncio front end that turns (audio, transcript, language, gesture profile) jobs into word/phone
+    timestamps and frames rows, all in memory. submit() waits while the bounded queue is full, jobs of
+    one language arriving within `batch_window` seconds share a single emission forward pass, and the
+    decode, torch and alignment stages run in a thread pool so the event loop stays free.
+    """
+    def __init__(self, max_queue: int = 64, max_batch: int = 8, batch_window: float = 0.01, max_inflight: int = 4,
+                 workers: int = None, device: str = None, frame_rate: int = None):
+        self.max_queue = max_queue
+        self.max_batch = max_batch
+        self.batch_window = batch_window
+        self.max_inflight = max_inflight
+        self.device = device or mms_models.default_device()
+        self.executor = ThreadPoolExecutor(workers or os.cpu_count() or 1)
+        self.frames = FramesBatch(frame_rate=frame_rate)
+        self.latencies = deque(maxlen=STATS_WINDOW)
+        self.batch_sizes = deque(maxlen=STATS_WINDOW)
+        self._aligners = {}
+        self._aligners_lock = threading.Lock()
+        self._dispatcher = None
+        self._collecting = []
+        self._closed = False
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue(self.max_queue)
+        self._inflight = asyncio.Semaphore(self.max_inflight)
+        self._tasks = set()
+        self._closed = False
+        self._dispatcher = asyncio.create_task(self._dispatch())
+        return self
+
+    async def stop(self):
+        """
+        Stops taking jobs and lets the running batches finish. Jobs still queued or in the batch being
+        collected fail with a RuntimeError, so no submit() keeps waiting.
+        """
+        self._closed = True
+        if self._dispatcher:
+            self._dispatcher.cancel()
+            await asyncio.gather(self._dispatcher, return_exceptions=True)
+            self._dispatcher = None
+        self._fail_pending()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self.executor.shutdown(wait=True)
+
+    def _fail_pending(self):
+        pending, self._collecting = self._collecting, []
+        while not self._queue.empty():
+            pending.append(self._queue.get_nowait())
+        for job in pending:
+            if not job.future.done():
+                job.future.set_exception(RuntimeError("the alignment service was stopped before the job ran"))
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc):
+        await self.stop()
+
+    async def submit(self, audio, transcript: str, language: str = "english", gestures = "old"):
+        """
+        audio: encoded audio bytes, an audio file path or a mono float waveform at the MMS_FA sample rate
+        gestures: a default gesture set name or custom gesture params
+        Returns {"start", "end", "words", "phones", "frames"} with the frames.csv rows in "frames".
+        """
+        profile = self.frames.profiles[self.frames.profile_key(gestures)]
+        if self._closed:
+            com.RaiseError(RuntimeError, "the alignment service is stopped", logger)
+        job = _Job(audio, transcript, language.lower(), profile, self._loop.create_future())
+        await self._queue.put(job)
+        if self._closed:
+            # put() was waiting on a full queue while the service stopped
+            self._fail_pending()
+        return await job.future
+
+    def stats(self):
+        return {
+            "jobs": len(self.latencies),
+            "p50": round(percentile(self.latencies, 50), 4),
+            "p99": round(percentile(self.latencies, 99), 4),
+            "mean_batch": round(sum(self.batch_sizes)/len(self.batch_sizes), 2) if self.batch_sizes else 0.0,
+            "queued": self._queue.qsize() if self._dispatcher else 0,
+        }
+
+    async def _dispatch(self):
+        while True:
+            # no new batch is formed while max_inflight are running, so the queue fills up and submit() waits
+            await self._inflight.acquire()
+            # held on the instance so stop() can fail the jobs of a batch cancelled while it is collected
+            batch = self._collecting = [await self._queue.get()]
+            deadline = self._loop.time()+self.batch_window
+            while len(batch)<self.max_batch:
+                remaining = deadline-self._loop.time()
+                if remaining<=0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+
+            self._collecting = []
+            by_language = defaultdict(list)
+            for job in batch:
+                by_language[job.language].append(job)
+            groups = list(by_language.values())
+            # the permit taken above covers the first group, the others take their own
+            for i, jobs in enumerate(groups):
+                if i:
+                    await self._inflight.acquire()
+                task = asyncio.create_task(self._run(jobs))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+
+    async def _cpu(self, fn, *args):
+        return await self._loop.run_in_executor(self.executor, fn, *args)
+
+    async def _run(self, jobs: list):
+        try:
+            decoded = await asyncio.gather(*(self._cpu(self._decode, job.audio) for job in jobs), return_exceptions=True)
+            # a job with unreadable audio fails alone, the others are still batched
+            ok, waveforms = [], []
+            for job, res in zip(jobs, decoded):
+                if isinstance(res, BaseException):
+                    job.future.set_exception(res)
+                else:
+                    ok.append(job)
+                    waveforms.append(res)
+            jobs = ok
+            if not jobs:
+                return
+            emissions = await self._cpu(batch_emissions, waveforms, self.device)
+            results = await asyncio.gather(*(self._cpu(self._finish, job, emission, w.size(0))
+                                             for job, emission, w in zip(jobs, emissions, waveforms)),
+                                           return_exceptions=True)
+            self.batch_sizes.append(len(jobs))
+            for job, res in zip(jobs, results):
+                if isinstance(res, BaseException):
+                    job.future.set_exception(res)
+                else:
+                    self.latencies.append(time.perf_counter()-job.submitted)
+                    job.future.set_result(res)
+        except Exception as e:
+            logger.error(f"alignment batch of {len(jobs)} {jobs[0].language} jobs failed: {e}")
+            for job in jobs:
+                if not job.future.done():
+                    job.future.set_exception(e)
+        finally:
+            self._inflight.release()
+
+    def _decode(self, audio):
+        sr = mms_models.SAMPLE_RATE
+        if isinstance(audio, (bytes, bytearray)):
+            audio, _ = audio_io.decode_bytes(bytes(audio), sr)
+        elif isinstance(audio, (str, os.PathLike)):
+            audio, _ = audio_io.load(audio, sr)
+        return torch.as_tensor(audio, dtype=torch.float32)
+
+    def _aligner(self, language: str):
+        with self._aligners_lock:
+            if language not in self._aligners:
+                self._aligners[language] = Mfa_output(None, None, language=language, device=self.device)
+            return self._aligners[language]
+
+    def _finish(self, job: _Job, emission, num_samples: int):
+        with metrics.request("service_job", language=job.language):
+            result = self._aligner(job.language).align_words(emission, job.transcript, num_samples)
+            rows = phoneme_rows(result["words"], result["phones"])
+            frames = Frames(None, rows, profile=job.profile, frame_rate=job.profile.frame_rate,
+                            audio_duration=num_samples/mms_models.SAMPLE_RATE)
+            result["frames"] = frames.frame_rows()
+        return result
+
+
+async def run_load(service: AlignmentService, jobs: list, concurrency: int = 16):
+    """
+    Local fake client: keeps `concurrency` submit() calls in flight over `jobs` (dicts of submit
+    arguments) and reports throughput and client side latency percentiles.
+    """
+    sem = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(job):
+        async with sem:
+            t = time.perf_counter()
+            await service.submit(**job)
+            latencies.append(time.perf_counter()-t)
+
+    t = time.perf_counter()
+    await asyncio.gather(*(one(job) for job in jobs))
+    elapsed = time.perf_counter()-t
+    res = {
+        "jobs": len(jobs),
+        "concurrency": concurrency,
+        "seconds": round(elapsed, 3),
+        "jobs_per_sec": round(len(jobs)/elapsed, 2) if elapsed else 0.0,
+        "p50": round(percentile(latencies, 50), 4),
+        "p99": round(percentile(latencies, 99), 4),
+        "service": service.stats(),
+    }
+    logger.info(f"load test: {res}")
+    return res
+
+
+async def _main(voice_path: str, utterance_path: str, n_jobs: int, concurrency: int, language: str):
+    with open(voice_path, "rb") as f:
+        audio = f.read()
+    transcript = com.read_file(utterance_path, logger)
+    jobs = [{"audio": audio, "transcript": transcript, "language": language} for _ in range(n_jobs)]
+    async with AlignmentService() as service:
+        # one warm up job so model loading does not count as latency
+        await service.submit(**jobs[0])
+        service.latencies.clear()
+        return await run_load(service, jobs, concurrency)
+
+
+if __name__=="__main__":
+    voice_path, utterance_path, *rest = sys.argv[1:]
+    n_jobs = int(rest[0]) if rest else 100
+    concurrency = int(rest[1]) if len(rest)>1 else 16
+    language = rest[2] if len(rest)>2 else "english"
+    print(asyncio.run(_main(voice_path, utterance_path, n_jobs, concurrency, language)))
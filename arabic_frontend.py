@@ -0,0 +1,77 @@
+import os
+import string
+
+from ipatok import tokenise
+
+import common as com
+import metrics
+import language_resources as lr
+from oov_cache import LruCache
+from text_normalizer import normalize_uroman
+
+logger = com.get_logger(__name__)
+
+DEFAULT_SIZE = int(os.environ.get("ARABIC_FRONTEND_SIZE", 20000))
+# latin and arabic punctuation around a word is not part of its cache key
+_PUNCTS = string.punctuation+"،؛؟«»…"
+
+
+def word_key(word: str):
+    return word.strip(_PUNCTS)
+
+
+class ArabicFrontEnd(LruCache):
+    """
+    LRU of the phone tokens of Arabic words after diacritization (Mishkal) and romanization
+    (uroman). Mishkal picks vowels from the sentence context, so prepare() diacritizes a whole
+    utterance in one call and stores every word of it; word_phones() falls back to diacritizing
+    a word alone when its utterance was not prepared. A word keeps the result of the first
+    utterance it was seen in. One instance per process, from language_resources.get_arabic_frontend().
+    """
+    def __init__(self, maxsize: int = DEFAULT_SIZE):
+        super().__init__(maxsize)
+        self.utterances = 0
+
+    @staticmethod
+    def _phones(diacritized: str):
+        romanized = normalize_uroman(lr.get_uroman().romanize_string(diacritized)).replace(" ", "")
+        return tuple(tokenise(romanized)) if romanized else ()
+
+    def prepare(self, utterance: str):
+        """
+        Diacritizes and romanizes the words of `utterance` that are not cached yet, in one
+        Mishkal call over the whole utterance.
+        """
+        words = utterance.split()
+        if all(word_key(w) in self for w in words):
+            return
+        with metrics.span("arabic_diacritize"):
+            diacritized = lr.get_tashkeel().tashkeel(utterance).split()
+        self.utterances += 1
+        if len(diacritized)!=len(words):
+            # Mishkal re-spaced the punctuation, the words cannot be paired with their diacritized forms
+            logger.warning(f"diacritized utterance has {len(diacritized)} words instead of {len(words)}, diacritizing word by word")
+            diacritized = [lr.get_tashkeel().tashkeel(w) for w in words]
+        for w, d in zip(words, diacritized):
+            key = word_key(w)
+            if key and key not in self:
+                self.put(key, self._phones(d))
+
+    def word_phones(self, word: str):
+        """
+        Phone tokens of the romanized, diacritized word.
+        """
+        key = word_key(word)
+        if not key:
+            return []
+        value = self.get(key)
+        if value is None:
+            value = self.put(key, self._phones(lr.get_tashkeel().tashkeel(key)))
+        return list(value)
+
+    def stats(self):
+        return {**super().stats(), "utterances": self.utterances}
+
+    def clear(self):
+        super().clear()
+        self.utterances = 0
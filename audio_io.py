@@ -0,0 +1,152 @@
+import os
+import struct
+import threading
+from collections import OrderedDict, namedtuple
+
+import common as com
+import metrics
+
+logger = com.get_logger(__name__)
+
+AudioInfo = namedtuple("AudioInfo", ["sample_rate", "channels", "frames", "duration"])
+
+WAVEFORM_CACHE_SIZE = int(os.environ.get("WAVEFORM_CACHE_SIZE", 8))
+INFO_CACHE_SIZE = int(os.environ.get("AUDIO_INFO_CACHE_SIZE", 4096))
+
+_lock = threading.Lock()
+_info_cache = OrderedDict()
+_waveforms = OrderedDict()
+
+
+def _file_key(path: str):
+    st = os.stat(path)
+    return (os.fspath(path), st.st_mtime_ns, st.st_size)
+
+
+def _read_wav_header(path: str):
+    """
+    Reads sample rate, channels and frame count from the RIFF/RF64 WAVE headers without touching
+    the samples. Returns None for anything that is not a WAVE file.
+    """
+    file_size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        head = f.read(12)
+        if len(head)<12 or head[:4] not in (b"RIFF", b"RF64") or head[8:12]!=b"WAVE":
+            return None
+
+        channels = sample_rate = block_align = None
+        ds64_data_size = None
+        while True:
+            chunk = f.read(8)
+            if len(chunk)<8:
+                return None
+            chunk_id, size = struct.unpack("<4sI", chunk)
+            if chunk_id==b"fmt ":
+                fmt = f.read(size)
+                _, channels, sample_rate, _, block_align = struct.unpack_from("<HHIIH", fmt)
+                size = 0
+            elif chunk_id==b"ds64":
+                ds64 = f.read(size)
+                ds64_data_size = struct.unpack_from("<Q", ds64, 8)[0]
+                size = 0
+            elif chunk_id==b"data":
+                if size==0xFFFFFFFF and ds64_data_size is not None:
+                    size = ds64_data_size
+                # streamed files may leave the data size unset or too large
+                size = min(size, file_size-f.tell()) if size else file_size-f.tell()
+                break
+            f.seek(size + (size & 1), 1)
+
+    if not sample_rate or not block_align:
+        return None
+    frames = size // block_align
+    return AudioInfo(sample_rate, channels, frames, frames/sample_rate)
+
+
+def probe(path: str):
+    """
+    Sample rate, channels, frames and duration of an audio file, from the WAV headers when possible
+    and from soundfile otherwise. Results of the INFO_CACHE_SIZE most recently probed files are
+    cached until the file changes.
+    """
+    key = _file_key(path)
+    with _lock:
+        if key in _info_cache:
+            _info_cache.move_to_end(key)
+            return _info_cache[key]
+    info = _read_wav_header(path)
+    if info is None:
+        import soundfile as sf
+        sfi = sf.info(path)
+        info = AudioInfo(sfi.samplerate, sfi.channels, sfi.frames, sfi.frames/sfi.samplerate)
+    with _lock:
+        _info_cache[key] = info
+        if len(_info_cache)>INFO_CACHE_SIZE:
+            _info_cache.popitem(last=False)
+    return info
+
+
+def get_duration(path: str):
+    return probe(path).duration
+
+
+def _mono(y, native_sr: int, sr: int = None):
+    y = y.mean(axis=1) if y.shape[1]>1 else y[:, 0]
+    if sr and sr!=native_sr:
+        import librosa
+        y = librosa.resample(y, orig_sr=native_sr, target_sr=sr)
+    return y, sr or native_sr
+
+
+def _decode(path: str, sr: int = None, offset: float = 0, duration: float = None):
+    import soundfile as sf
+    native_sr = probe(path).sample_rate
+    start = int(round(offset*native_sr))
+    frames = -1 if duration is None else int(round(duration*native_sr))
+    with metrics.span("decode"):
+        y, native_sr = sf.read(path, start=start, frames=frames, dtype="float32", always_2d=True)
+        return _mono(y, native_sr, sr)
+
+
+def load(path: str, sr: int = None):
+    """
+    Mono float32 waveform of the whole file, resampled to `sr` when given. The last
+    WAVEFORM_CACHE_SIZE decoded waveforms are kept, so a file is decoded once per request.
+    """
+    key = _file_key(path) + (sr,)
+    with _lock:
+        if key in _waveforms:
+            _waveforms.move_to_end(key)
+            metrics.count("waveform_cache_hits")
+            return _waveforms[key]
+
+    res = _decode(path, sr)
+    with _lock:
+        _waveforms[key] = res
+        if len(_waveforms)>WAVEFORM_CACHE_SIZE:
+            _waveforms.popitem(last=False)
+    return res
+
+
+def load_window(path: str, offset: float, duration: float = None, sr: int = None):
+    """
+    Decodes only `duration` seconds starting at `offset`, without caching.
+    """
+    return _decode(path, sr, offset, duration)
+
+
+def decode_bytes(data: bytes, sr: int = None):
+    """
+    Mono float32 waveform of an encoded audio file held in memory.
+    """
+    import io
+    import soundfile as sf
+    with metrics.span("decode"):
+        y, native_sr = sf.read(io.BytesIO(data), dtype="float32", always_2d=True)
+        return _mono(y, native_sr, sr)
+
+
+def clear():
+    with _lock:
+        _info_cache.clear()
+        _waveforms.clear()
@@ -0,0 +1,989 @@
+import os
+import sys
+import json
+import time
+import wave
+import random
+import tempfile
+import platform
+import tracemalloc
+import subprocess
+import statistics
+from types import SimpleNamespace
+from contextlib import contextmanager
+
+import common as com
+
+logger = com.get_logger(__name__)
+
+
+def _summary(name: str, timings: list):
+    timings = sorted(timings)
+    res = {
+        "name": name,
+        "runs": len(timings),
+        "mean": round(statistics.mean(timings), 4),
+        "p50": round(timings[len(timings)//2], 4),
+        "max": round(timings[-1], 4),
+    }
+    logger.info(f"{name}: {res}")
+    return res
+
+
+def check_batch_emissions(seconds: str = "1,2.5,4", device: str = None, seed: int = 0, atol: float = 1e-4):
+    """
+    Compares batch_emissions on one bucket of mixed length clips with the emission of every clip
+    run alone, as get_token_spans_pytorch computes it.
+    """
+    import torch
+    import mms_models
+    from multilingual import Mfa_output, batch_emissions
+
+    gen = torch.Generator().manual_seed(int(seed))
+    waveforms = [0.1*torch.randn(int(float(s)*mms_models.SAMPLE_RATE), generator=gen) for s in str(seconds).split(",")]
+    mo = Mfa_output(None, None, device=device, alignment_cache=False)
+    for i, (w, emission) in enumerate(zip(waveforms, batch_emissions(waveforms, mo.device))):
+        single = mo._emission(w.unsqueeze(0))[0].cpu()
+        if single.shape!=emission.shape or not torch.allclose(single, emission, atol=float(atol)):
+            com.RaiseError(AssertionError, f"batched emission of clip {i} differs from the emission of the clip alone", logger)
+    return len(waveforms)
+
+
+def bench_mms_fa_warm(voice_path: str, utterance_path: str, runs: int = 5, device: str = None):
+    """
+    Per-utterance alignment latency with a cold MMS_FA model (registry cleared
+    before every run) versus the warm pooled model, after checking batched emissions.
+    """
+    import torch
+    import audio_io
+    import mms_models
+    from multilingual import Mfa_output
+
+    check_batch_emissions(device=device)
+
+    mo = Mfa_output(utterance_path, voice_path, device=device)
+    waveform, _ = audio_io.load(voice_path, sr=mms_models.SAMPLE_RATE)
+    waveform = torch.from_numpy(waveform).unsqueeze(0)
+    # the romanized, punctuation free words the MMS_FA tokenizer accepts, as production builds them
+    _, transcript = mo._read_words()
+
+    cold = []
+    for _ in range(int(runs)):
+        mms_models.clear()
+        t = time.perf_counter()
+        mo.get_token_spans_pytorch(waveform, transcript)
+        cold.append(time.perf_counter()-t)
+
+    mms_models.warmup(mo.device)
+    warm = []
+    for _ in range(int(runs)):
+        t = time.perf_counter()
+        mo.get_token_spans_pytorch(waveform, transcript)
+        warm.append(time.perf_counter()-t)
+    return [_summary("mms_fa_cold", cold), _summary("mms_fa_warm", warm)]
+
+
+_STARTUP_SCRIPT = """
+import json, resource, sys, time
+t = time.perf_counter()
+import multilingual
+imported = time.perf_counter()-t
+rss_import = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+langs = json.loads(sys.argv[1])
+if langs is not None:
+    multilingual.preload(langs or None)
+print(json.dumps({
+    "import_s": round(imported, 4),
+    "total_s": round(time.perf_counter()-t, 4),
+    "rss_import_mb": round(rss_import/1024, 1),
+    "rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024, 1),
+}))
+"""
+
+
+def bench_startup(runs: int = 3):
+    """
+    Import time and peak RSS of a fresh interpreter importing multilingual: lazily
+    (nothing loaded), serving english only, and with every language preloaded,
+    which is what every worker paid before resources became lazy.
+    """
+    res = {}
+    for name, langs in [("lazy", None), ("english", ["english"]), ("preload_all", [])]:
+        out = []
+        for _ in range(int(runs)):
+            proc = subprocess.run([sys.executable, "-c", _STARTUP_SCRIPT, json.dumps(langs)], capture_output=True, text=True, check=True)
+            out.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+        res[name] = {k: min(o[k] for o in out) for k in out[0]}
+        logger.info(f"startup {name}: {res[name]}")
+    return res
+
+
+def _naive_join_word_phones(words: list, phones: list, oov, convert):
+    # the words x phones loop mfa_output used before join_word_phones
+    out = []
+    for w_sta, w_end, w in words:
+        for p_sta, p_end, p in phones:
+            if len(p)>2 and p[-2:] in ["_B", "_E", "_I", "_S"]:
+                p = p[:-2]
+            if p_sta<w_sta or p_end>w_end:
+                continue
+            elif w_sta==p_sta and w_end==p_end and p.startswith("spn"):
+                out.extend(oov(p_sta, p_end, w))
+                break
+            else:
+                if p.strip():
+                    p = convert(p)
+                out.append([p_sta, p_end, p.upper()])
+    return out
+
+
+def synthetic_tiers(seconds: float, seed: int = 0):
+    """
+    MFA-like word and phone tiers covering `seconds` of speech: words of 1-6 position
+    tagged phones, silences between some words and an occasional 'spn' word.
+    """
+    rnd = random.Random(seed)
+    phone_set = ["AA1", "AE1", "B", "D", "EH1", "F", "IY1", "K", "L", "M", "N", "OW1", "R", "S", "T", "UW1"]
+    words, phones = [], []
+    t = 0.0
+    while t<seconds:
+        if rnd.random()<0.15:
+            end = round(t+rnd.uniform(0.1, 0.5), 2)
+            words.append([t, end, " "])
+            phones.append([t, end, " "])
+            t = end
+        n = rnd.randint(1, 6)
+        w_sta = t
+        if rnd.random()<0.03:
+            t = round(t+rnd.uniform(0.2, 0.6), 2)
+            phones.append([w_sta, t, "spn"])
+        else:
+            for i in range(n):
+                end = round(t+rnd.uniform(0.04, 0.15), 2)
+                suffix = "_S" if n==1 else "_B" if i==0 else "_E" if i==n-1 else "_I"
+                phones.append([t, end, rnd.choice(phone_set)+suffix])
+                t = end
+        words.append([w_sta, t, f"w{len(words)}"])
+    return words, phones
+
+
+def bench_word_phone_join(minutes: float = 10, runs: int = 3):
+    """
+    join_word_phones against the previous nested loop on a synthetic transcript of `minutes`.
+    """
+    from multilingual import join_word_phones
+
+    words, phones = synthetic_tiers(float(minutes)*60)
+    oov = lambda sta, end, w: [[sta, end, "AH0"]]
+    convert = lambda p: p
+    res = []
+    for name, fn in [("naive_join", _naive_join_word_phones), ("join_word_phones", join_word_phones)]:
+        timings = []
+        for _ in range(int(runs)):
+            t = time.perf_counter()
+            out = fn(words, phones, oov, convert)
+            timings.append(time.perf_counter()-t)
+        res.append(_summary(f"{name}_{len(words)}w_{len(phones)}p", timings))
+        if name=="naive_join":
+            expected = out
+        elif out!=expected:
+            com.RaiseError(AssertionError, "join_word_phones output differs from the nested loop", logger)
+    return res
+
+
+def _notebook_viterbi(obs_indices, transition_prob, emission_prob, initial_prob):
+    # the probability space prototype from viterbi_algorithm_implementation.ipynb
+    import numpy as np
+    n_states = len(initial_prob)
+    T = len(obs_indices)
+    V = np.zeros((n_states, T))
+    path = np.zeros((n_states, T), dtype=int)
+    for s in range(n_states):
+        V[s, 0] = initial_prob[s] * emission_prob[s, obs_indices[0]]
+        path[s, 0] = s
+    for t in range(1, T):
+        for s in range(n_states):
+            max_prob = -1
+            prev_state = -1
+            for s_prev in range(n_states):
+                prob = V[s_prev, t-1] * transition_prob[s_prev, s] * emission_prob[s, obs_indices[t]]
+                if prob > max_prob:
+                    max_prob = prob
+                    prev_state = s_prev
+            V[s, t] = max_prob
+            path[s, t] = prev_state
+    best_last_state = np.argmax(V[:, T-1])
+    best_path = [best_last_state]
+    for t in range(T-1, 0, -1):
+        best_last_state = path[best_last_state, t]
+        best_path.insert(0, best_last_state)
+    return best_path
+
+
+def _path_log_prob(path, obs, trans, emis, init):
+    import numpy as np
+    with np.errstate(divide="ignore"):
+        lp = np.log(init[path[0]]*emis[path[0], obs[0]])
+        for t in range(1, len(path)):
+            lp += np.log(trans[path[t-1], path[t]]*emis[path[t], obs[t]])
+    return lp
+
+
+def check_viterbi(cases: int = 50, seed: int = 0):
+    """
+    Compares viterbi against the notebook prototype: the notebook's weather example and
+    random short sequences, where probability space does not underflow yet.
+    """
+    import numpy as np
+    from viterbi import viterbi
+
+    transition_prob = np.array([[0.7,0.2,0.1],[0.3,0.4,0.3],[0.2,0.3,0.5]])
+    emission_prob = np.array([[0.8, 0.2, 0.0], [0.2, 0.6, 0.2],  [0.1, 0.3, 0.6]])
+    initial_prob = np.array([0.6, 0.3, 0.1])
+    path, score = viterbi([0, 1, 2], transition_prob, emission_prob, initial_prob)
+    # Most likely sequence of states: ['Sunny', 'Cloudy', 'Rainy'], V[Rainy, 2] = 0.010368
+    if path.tolist()!=[0, 1, 2] or not np.isclose(np.exp(score), 0.010368):
+        com.RaiseError(AssertionError, f"weather example decoded to {path.tolist()} with {np.exp(score)}", logger)
+
+    rnd = np.random.default_rng(seed)
+    for _ in range(int(cases)):
+        n_states, n_obs, T = rnd.integers(2, 8), rnd.integers(2, 6), rnd.integers(1, 30)
+        trans = rnd.dirichlet(np.ones(n_states), n_states)
+        emis = rnd.dirichlet(np.ones(n_obs), n_states)
+        init = rnd.dirichlet(np.ones(n_states))
+        obs = rnd.integers(0, n_obs, T).tolist()
+        path, score = viterbi(obs, trans, emis, init)
+        expected = [int(s) for s in _notebook_viterbi(obs, trans, emis, init)]
+        # paths may only differ where two paths tie up to rounding
+        if path.tolist()!=expected and not np.isclose(score, _path_log_prob(expected, obs, trans, emis, init)):
+            com.RaiseError(AssertionError, f"viterbi path {path.tolist()} differs from the notebook {expected}", logger)
+    return int(cases)+1
+
+
+def bench_viterbi(frames: int = 10000, states: int = 300, batch: int = 4, band: int = 2):
+    """
+    Batched full and banded decoding of `batch` sequences of `frames` frames over a left-to-right
+    model with `states` states, after checking the decoder against the notebook prototype.
+    """
+    import numpy as np
+    from viterbi import viterbi_batch, to_log
+
+    check_viterbi()
+    frames, states, batch, band = int(frames), int(states), int(batch), int(band)
+    rnd = np.random.default_rng(0)
+    trans = np.zeros((states, states))
+    for s in range(states):
+        nxt = rnd.dirichlet(np.ones(min(band+1, states-s)))
+        trans[s, s:s+len(nxt)] = nxt
+    log_trans = to_log(trans)
+    log_init = to_log(np.eye(states)[0])
+    log_emis = np.log(rnd.dirichlet(np.ones(states), (batch, frames)))
+    lengths = rnd.integers(frames//2, frames+1, batch)
+    lengths[0] = frames
+
+    res = []
+    decoded = {}
+    for name, kwargs in [("full", {}), (f"band_{band}", {"band": band})]:
+        t = time.perf_counter()
+        decoded[name] = viterbi_batch(log_emis, log_trans, log_init, lengths=lengths, **kwargs)
+        res.append(_summary(f"viterbi_{name}_{batch}x{frames}x{states}", [time.perf_counter()-t]))
+    (p_full, s_full), (p_band, s_band) = decoded.values()
+    if not np.allclose(s_full, s_band):
+        com.RaiseError(AssertionError, "banded decoding changed the best path scores", logger)
+    return res
+
+
+def write_silence(path: str, seconds: float, sample_rate: int = 16000):
+    with wave.open(path, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(sample_rate)
+        f.writeframes(b"\0\0"*int(seconds*sample_rate))
+    return path
+
+
+def synthetic_gestures(n: int, weight: int, n_context: int = 0, seed: int = 0):
+    """
+    Gesture params in the frames_defaults.json layout: `n` talk/hand/talk_head gestures of
+    `weight` each and `n_context` context gestures triggered by the words w0, w1, ...
+    """
+    rnd = random.Random(seed)
+    params = {}
+    for i in range(n):
+        kind = ["talk", "hand", "talk_head"][i%3]
+        params[f"{kind}_{i}"] = {"frames": rnd.randint(20, 150), "weight": weight}
+    params["context_gestures"] = {
+        f"context_{i}": {"frames": rnd.randint(30, 90), "words": [f"w{rnd.randrange(5000)}" for _ in range(rnd.randint(1, 8))]}
+        for i in range(n_context)
+    }
+    return params
+
+
+def bench_gesture_weights(weights: str = "1,100,10000", gestures: int = 60, minutes: float = 10, runs: int = 3):
+    """
+    Frames.frames() on a synthetic transcript for gesture libraries of growing weights.
+    """
+    from copy import deepcopy
+    from frames_integrate import Frames, phoneme_rows
+
+    words, phones = synthetic_tiers(float(minutes)*60)
+    rows = phoneme_rows(words, phones)
+    res = []
+    with tempfile.TemporaryDirectory() as tmp:
+        voice_path = write_silence(os.path.join(tmp, "voice.wav"), words[-1][1])
+        for weight in [int(w) for w in str(weights).split(",")]:
+            params = synthetic_gestures(int(gestures), weight, n_context=40)
+            timings = []
+            for seed in range(int(runs)):
+                random.seed(seed)
+                t = time.perf_counter()
+                Frames(voice_path, rows, gesture_params={"params": deepcopy(params)}, frame_rate=30).frames()
+                timings.append(time.perf_counter()-t)
+            res.append(_summary(f"frames_weight_{weight}", timings))
+    return res
+
+
+def _naive_context_gestures(frames):
+    # the list and linear catalogue scan Frames._context_gestures used before the word index
+    non_context_ranges = []
+    w_l = []
+    st = 0
+    ge_end = 0
+    for i, l in enumerate(frames.phonemes):
+        if ge_end>=frames.audio_duration:
+            break
+        w, sta, end = l[3:6]
+        if w not in w_l:
+            w_l.append(w)
+            for ge, dur, words in frames.context_gestures:
+                if w in words:
+                    if sta>=ge_end:
+                        ge_end = sta+dur
+                        if ge_end>frames.audio_duration:
+                            ge_end = frames.audio_duration
+                            sta = round(ge_end-dur, 2)
+                        frames.timeline.add(round(sta, 2), ge)
+                        non_context_ranges.append([st, sta])
+                        st = ge_end
+                    break
+        if i==len(frames.phonemes)-1:
+            if end<frames.audio_duration:
+                end = frames.audio_duration
+            if st<end:
+                non_context_ranges.append([st, end])
+    return non_context_ranges
+
+
+def bench_context_gestures(context: int = 500, minutes: float = 10, runs: int = 3):
+    """
+    Frames._context_gestures with a catalogue of `context` context gestures against the
+    previous linear scan, checking both place the same gestures.
+    """
+    from frames_integrate import Frames, phoneme_rows
+
+    words, phones = synthetic_tiers(float(minutes)*60)
+    rows = phoneme_rows(words, phones)
+    params = synthetic_gestures(30, 5, n_context=int(context))
+    res = []
+    with tempfile.TemporaryDirectory() as tmp:
+        voice_path = write_silence(os.path.join(tmp, "voice.wav"), words[-1][1])
+        outputs = {}
+        for name in ["naive_context_gestures", "context_gestures"]:
+            timings = []
+            for _ in range(int(runs)):
+                f = Frames(voice_path, rows, gesture_params={"params": params}, frame_rate=30)
+                t = time.perf_counter()
+                ranges = _naive_context_gestures(f) if name.startswith("naive") else f._context_gestures()
+                timings.append(time.perf_counter()-t)
+            outputs[name] = (ranges, f.timeline.rows())
+            res.append(_summary(f"{name}_{context}", timings))
+    if outputs["naive_context_gestures"]!=outputs["context_gestures"]:
+        com.RaiseError(AssertionError, "the word index placed context gestures differently", logger)
+    return res
+
+
+def _list_frame_rows(frames_list: list, frame_rate: int):
+    # the sort and walk over (timestamp, name) tuples Frames.frame_rows used before FrameTimeline
+    fl = sorted(frames_list, key=lambda x: x[0])
+    rows = []
+    prev_t = None
+    for t, anim in fl:
+        if t==prev_t:
+            t = t+1/frame_rate
+        rows.append([t, anim])
+        prev_t = t
+    return rows
+
+
+def bench_frame_timeline(entries: int = 200000, tracks: int = 8, frame_rate: int = 30, runs: int = 3):
+    """
+    Sorting and collision nudging of `entries` gesture starts spread over `tracks` tracks on a
+    timeline of one frame per entry, the list walk against FrameTimeline.
+    """
+    from frames_integrate import FrameTimeline
+
+    entries, tracks, frame_rate = int(entries), int(tracks), int(frame_rate)
+    rnd = random.Random(0)
+    names = [f"gesture_{i}" for i in range(60)]
+    starts = [round(rnd.randrange(entries)/frame_rate, 2) for _ in range(entries)]
+    gestures = [rnd.choice(names) for _ in range(entries)]
+    frames_list = list(zip(starts, gestures))
+    per_track = -(-entries//tracks)
+
+    def timeline():
+        tl = FrameTimeline()
+        for i in range(0, entries, per_track):
+            tl.extend(starts[i:i+per_track], gestures[i:i+per_track])
+        return tl, tl.resolved(frame_rate)
+
+    res = []
+    outputs = {}
+    for name, fn in (("list", lambda: _list_frame_rows(frames_list, frame_rate)), ("timeline", timeline)):
+        timings = []
+        for _ in range(int(runs)):
+            tracemalloc.start()
+            t = time.perf_counter()
+            outputs[name] = fn()
+            timings.append(time.perf_counter()-t)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        r = _summary(f"frame_{name}_{entries}", timings)
+        r["peak_mb"] = round(peak/2**20, 2)
+        res.append(r)
+    tl, (times, ids) = outputs["timeline"]
+    if outputs["list"]!=[[t, tl.names.strings[i]] for t, i in zip(times.tolist(), ids.tolist())]:
+        com.RaiseError(AssertionError, "FrameTimeline resolved the timeline differently", logger)
+
+    # starts less than a frame apart must still get distinct, increasing frame indices
+    tl = FrameTimeline()
+    tl.extend([0.33, 0.34, 1.0, 1.0, 1.03], ["a", "b", "c", "d", "e"])
+    frames, ids = tl.frame_indices(30)
+    if frames.tolist()!=[10, 11, 30, 31, 32] or [tl.names.strings[i] for i in ids.tolist()]!=list("abcde"):
+        com.RaiseError(AssertionError, f"sub-frame starts were quantized to {frames.tolist()}", logger)
+    frames, _ = outputs["timeline"][0].frame_indices(frame_rate)
+    if len(frames)>1 and (frames[1:]<=frames[:-1]).any():
+        com.RaiseError(AssertionError, "FrameTimeline gave repeated or decreasing frame indices", logger)
+    return res
+
+
+def bench_alignment_cache(voice_path: str, utterance_path: str, runs: int = 5):
+    """
+    mfa_output latency of a repeated job with the alignment cache disabled versus a warm cache.
+    """
+    import alignment_cache
+    from multilingual import Mfa_output
+
+    cache = alignment_cache.AlignmentCache(tempfile.mkdtemp())
+    res = []
+    for name, kwargs in (("uncached", {"alignment_cache": False}), ("cached", {"alignment_cache": cache})):
+        mo = Mfa_output(utterance_path, voice_path, **kwargs)
+        mo.mfa_output(save=False)
+        timings = []
+        for _ in range(int(runs)):
+            t = time.perf_counter()
+            mo.mfa_output(save=False)
+            timings.append(time.perf_counter()-t)
+        res.append(_summary(f"mfa_output_{name}", timings))
+    res.append(cache.stats())
+    return res
+
+
+# fixed letter to ARPA table standing in for g2p_en, and IPA symbols standing in for ipa_to_arpa.json
+_LETTER_PHONES = {
+    "a": "AE1", "b": "B", "d": "D", "e": "EH1", "f": "F", "i": "IY1", "k": "K", "l": "L",
+    "m": "M", "n": "N", "o": "OW1", "r": "R", "s": "S", "t": "T", "u": "UW1",
+}
+_STUB_IPA = {"ʃ": "SH", "ŋ": "NG", "ə": "AH0", "ɪ": "IH1", "θ": "TH", "ʊ": "UH1"}
+
+
+class _StubG2p:
+    def __call__(self, word: str):
+        return [_LETTER_PHONES[c] for c in word.lower() if c in _LETTER_PHONES] or ["AH0"]
+
+
+def _stub_ratios(path: str, seed: int = 0):
+    # phoneme_ratios.json layout over the stub phones, with some combinations left out for the fallback
+    rnd = random.Random(seed)
+    phones = [*_LETTER_PHONES.values(), *_STUB_IPA.values()]
+    tagged = [p+s for p in phones for s in ("_B", "_E", "_I", "_S")]
+    ratios = {}
+    for cur in tagged:
+        ratios[cur] = {prev: {nxt: round(rnd.uniform(0.2, 1.5), 3) for nxt in rnd.sample(tagged+["-"], 20)}
+                       for prev in rnd.sample(tagged+["-"], 20)}
+    with open(path, "w") as f:
+        json.dump(ratios, f)
+    return path
+
+
+@contextmanager
+def stub_models(tmp: str, language: str = "english"):
+    """
+    Replaces the MFA aligner, g2p_en, ipa_to_arpa.json and the phoneme ratio index with synthetic
+    stand-ins for the duration of the block, so Mfa_output can be built without models or network.
+    Only the post-processing after alignment can run against the stub acoustic model.
+    """
+    import multilingual
+    import phoneme_index
+    import language_resources as lr
+
+    idx_path = phoneme_index.compile_index(_stub_ratios(os.path.join(tmp, "ratios.json")), os.path.join(tmp, "ratios.idx"))
+    stubs = {"g2p": _StubG2p(), "ipa2arpa": dict(_STUB_IPA), "phoneme_index": phoneme_index.PhonemeRatioIndex(idx_path)}
+    acoustic_model = SimpleNamespace(name="stub", meta={"version": "stub"}, mfcc_computer=None)
+    aligner = SimpleNamespace(acoustic_model=acoustic_model, lexicon_compiler=None, tokenizer=None, conf={})
+    saved = {k: lr._resources.get(k) for k in stubs}
+    get_aligners = multilingual.get_aligners
+    lr._resources.update(stubs)
+    multilingual.get_aligners = lambda list_=False: {language: aligner}
+    try:
+        yield stubs
+    finally:
+        multilingual.get_aligners = get_aligners
+        for k, v in saved.items():
+            if v is None:
+                lr._resources.pop(k, None)
+            else:
+                lr._resources[k] = v
+        stubs["phoneme_index"].close()
+
+
+def bench_alignment_service(jobs: int = 32, concurrency: int = 16, seconds: float = 3, max_batch: int = 8):
+    """
+    AlignmentService under the run_load fake client on synthetic clips, checking that concurrent
+    jobs were coalesced into batches of more than one.
+    """
+    import asyncio
+    from alignment_service import AlignmentService, run_load
+
+    transcript = "the order will arrive on monday please call us"
+    with tempfile.TemporaryDirectory() as tmp, stub_models(tmp):
+        with open(write_silence(os.path.join(tmp, "voice.wav"), float(seconds)), "rb") as f:
+            audio = f.read()
+        load = [{"audio": audio, "transcript": transcript} for _ in range(int(jobs))]
+
+        async def run():
+            async with AlignmentService(max_batch=int(max_batch), batch_window=0.05) as service:
+                return await run_load(service, load, int(concurrency))
+
+        res = asyncio.run(run())
+    if res["service"]["mean_batch"]<=1:
+        com.RaiseError(AssertionError, f"no jobs were batched together: {res['service']}", logger)
+    return res
+
+
+def synthetic_corpus(seconds: float, vocab: int = 2000, seed: int = 0):
+    """
+    synthetic_tiers with the words drawn from a vocabulary of `vocab` pseudo words and some phones
+    given as IPA, as an MFA textgrid json export: the input of Mfa_output's post-processing.
+    """
+    rnd = random.Random(seed)
+    consonants = [c for c in _LETTER_PHONES if c not in "aeiou"]
+    vocabulary = ["".join(rnd.choice(consonants)+rnd.choice("aeiou") for _ in range(rnd.randint(1, 4))) for _ in range(vocab)]
+    words, phones = synthetic_tiers(seconds, seed)
+    words = [[sta, end, "<eps>" if not w.strip() else rnd.choice(vocabulary)] for sta, end, w in words]
+    ipa = list(_STUB_IPA)
+    phones = [[sta, end, "sil" if not p.strip() else rnd.choice(ipa) if rnd.random()<0.1 else p] for sta, end, p in phones]
+    return {
+        "start": 0,
+        "end": words[-1][1],
+        "tiers": {"words": {"type": "interval", "entries": words}, "phones": {"type": "interval", "entries": phones}},
+    }
+
+
+def _measure(fn, runs: int):
+    timings = []
+    for _ in range(runs):
+        t = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter()-t)
+    # a separate run, tracemalloc slows the timed ones down
+    tracemalloc.start()
+    try:
+        fn()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return timings, peak
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def bench_suite(out_path: str = "bench_results.json", minutes: str = "0.5,2,8", runs: int = 3, vocab: int = 2000):
+    """
+    Post-processing, _oov, convert_ipa_arpa, phoneme ratio lookups and Frames.frames() on synthetic
+    corpora of growing length, against stub models. Wall times and tracemalloc peaks go to
+    `out_path` as json for bench_compare.
+    """
+    from copy import deepcopy
+    from multilingual import Mfa_output
+    from oov_cache import OovCache
+    from frames_integrate import Frames, GestureProfile, phoneme_rows
+
+    runs = int(runs)
+    results = []
+    with tempfile.TemporaryDirectory() as tmp, stub_models(tmp) as stubs:
+        profile = GestureProfile(synthetic_gestures(60, 100, n_context=40), 30)
+        for m in [float(m) for m in str(minutes).split(",")]:
+            export = synthetic_corpus(m*60, int(vocab))
+            words = export["tiers"]["words"]["entries"]
+            phones = export["tiers"]["phones"]["entries"]
+            voice_path = write_silence(os.path.join(tmp, "voice.wav"), export["end"])
+            utterance_path = os.path.join(tmp, "utterance.txt")
+            with open(utterance_path, "w") as f:
+                f.write(" ".join(w for _, _, w in words if w!="<eps>"))
+            # no OOV memo, every spn word goes through G2P
+            mo = Mfa_output(utterance_path, voice_path, alignment_cache=False, oov_cache=OovCache(0))
+
+            nd = mo._tiers_to_output(deepcopy(export))
+            spn = {(sta, end) for sta, end, p in phones if p=="spn"}
+            oov_words = [w for sta, end, w in words if (sta, end) in spn]
+            labels = [p for _, _, p in phones if p not in ("sil", "spn")]
+            tagged = [mo._assign_phoneme_suffix(p[:-2] if p[-2:] in ("_B", "_E", "_I", "_S") else p, 0, 1) for p in labels]
+            triples = [(cur, prev, nxt) for prev, cur, nxt in zip(["-"]+tagged, tagged, tagged[1:]+["-"])]
+            rows = phoneme_rows(nd["words"], nd["phones"])
+            ratios = stubs["phoneme_index"]
+
+            def frames():
+                random.seed(0)
+                Frames(voice_path, rows, profile=profile, frame_rate=30).frames()
+
+            stages = {
+                "postprocess": (len(phones), lambda: mo._tiers_to_output(deepcopy(export))),
+                "oov": (len(oov_words), lambda: [mo._oov(0.0, 1.0, w) for w in oov_words]),
+                "convert_ipa_arpa": (len(labels), lambda: [mo.convert_ipa_arpa(p) for p in labels]),
+                "ratio_lookup": (len(triples), lambda: [ratios.ratio(c, p, n) for c, p, n in triples]),
+                "frames": (len(rows), frames),
+            }
+            for stage, (items, fn) in stages.items():
+                timings, peak = _measure(fn, runs)
+                res = _summary(f"{stage}_{m}min", timings)
+                res.update({"stage": stage, "minutes": m, "items": items, "peak_kb": round(peak/1024, 1)})
+                results.append(res)
+
+    out = {
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "timestamp": time.time(),
+        "runs": runs,
+        "results": results,
+    }
+    with open(out_path, "w") as f:
+        json.dump(out, f, indent=2)
+    logger.info(f"wrote {len(results)} benchmark results to {out_path}")
+    return out_path
+
+
+def bench_compare(baseline_path: str, current_path: str, tolerance: float = 0.1):
+    """
+    Mean time and peak memory ratios of two bench_suite result files, flagging the stages that got
+    slower or larger by more than `tolerance`.
+    """
+    with open(baseline_path) as f:
+        baseline = {r["name"]: r for r in json.load(f)["results"]}
+    with open(current_path) as f:
+        current = json.load(f)["results"]
+    tolerance = float(tolerance)
+    res = []
+    for r in current:
+        b = baseline.get(r["name"])
+        if not b:
+            continue
+        time_ratio = r["mean"]/b["mean"] if b["mean"] else float("inf")
+        mem_ratio = r["peak_kb"]/b["peak_kb"] if b["peak_kb"] else float("inf")
+        res.append({
+            "name": r["name"],
+            "time_ratio": round(time_ratio, 3),
+            "peak_ratio": round(mem_ratio, 3),
+            "regression": time_ratio>1+tolerance or mem_ratio>1+tolerance,
+        })
+    for r in res:
+        if r["regression"]:
+            logger.warning(f"regression in {r['name']}: {r}")
+    return res
+
+
+class _NotebookNormalizer:
+    # the separate passes of the TextNormalizer prototype in text_processing_testing.ipynb, with its tables
+    CUSTOM_CONVERSION = {
+        "&": "and",
+        "’": "'",
+    }
+    MONTHS = {
+        1: "January", 2: "February", 3: "March", 4: "April",
+        5: "May", 6: "June", 7: "July", 8: "August",
+        9: "September", 10: "October", 11: "November", 12: "December"
+    }
+    DAYS = {
+        1: ["First"], 2: ["Second"], 3: ["Third"], 4: ["Fourth"],
+        5: ["Fifth"], 6: ["Sixth"], 7: ["Seventh"], 8: ["Eighth"],
+        9: ["Nineth"], 10: ["Tenth"], 11: ["Eleventh"], 12: ["Twelfth"],
+        13: ["Thirteenth"], 14: ["Fourteenth"], 15: ["Fifteenth"],
+        16: ["Sixteenth"], 17: ["Seventh"], 18: ["Eighteenth"],
+        19: ["Nineteenth"], 20: ["Twentieth"], 21: ["Twenty", "First"],
+        22: ["Twenty", "Second"], 23: ["Twenty", "Third"],
+        24: ["Twenty", "Fourth"], 25: ["Twenty", "Fifth"],
+        26: ["Twenty", "Sixth"], 27: ["Twenty", "Seventh"],
+        28: ["Twenty", "Eighth"], 29: ["Twenty", "Nineth"],
+        30: ["Thirtieth"], 31: ["Thirty", "First"]
+    }
+
+    def __init__(self, lang: str = "english", cust_pron: dict = None):
+        import re
+        import string
+        self.re = re
+        self.lang = lang
+        self.puncts = string.punctuation
+        self.cust_pron = cust_pron or {}
+
+    def _custom_changes(self, utt):
+        for k, v in self.cust_pron.items():
+            utt = self.re.sub(r'\b' + self.re.escape(k) + r'\b', v, utt)
+        for k, v in self.CUSTOM_CONVERSION.items():
+            utt = utt.replace(k, v)
+        return utt
+
+    def _pre_normalize(self, utt):
+        if self.lang=="hindi":
+            utt = utt.replace("।", ".").replace("|", ".")
+        while "  " in utt:
+            utt = utt.replace("  ", " ")
+        for c in "?.,!''\"":
+            if f" {c}" in utt:
+                utt = utt.replace(f" {c}", f"{c}")
+        return utt
+
+    def _remove_emojis(self, inp):
+        emoji_pattern = self.re.compile("["
+            u"\U0001F600-\U0001F64F" u"\U0001F300-\U0001F5FF" u"\U0001F680-\U0001F6FF" u"\U0001F700-\U0001F77F"
+            u"\U0001F780-\U0001F7FF" u"\U0001F800-\U0001F8FF" u"\U0001F900-\U0001F9FF" u"\U0001FA00-\U0001FA6F"
+            u"\U0001FA70-\U0001FAFF" u"\U00002702-\U000027B0" u"\U000024C2-\U0001F251"
+            "]+", flags=self.re.UNICODE)
+        return emoji_pattern.sub(r'', inp)
+
+    def _normalize_date(self, word):
+        # the notebook only has a placeholder, dates are spelled out as day, month and year
+        punct = word[-1] if word[-1] in self.puncts else ""
+        m = self.re.fullmatch(r"(\d{1,2})[/.-](\d{1,2})[/.-](\d{2,4})", word[:len(word)-len(punct)])
+        if not m or int(m.group(1)) not in self.DAYS or int(m.group(2)) not in self.MONTHS:
+            return [word]
+        return self.DAYS[int(m.group(1))]+[self.MONTHS[int(m.group(2))], m.group(3)+punct]
+
+    def _split_ssml_tags(self, utt):
+        result_list = []
+        for spl in self.re.split(self.re.compile(r'(<.*?>)'), utt):
+            if not spl.strip() or (spl.startswith("<") and spl.endswith(">")):
+                continue
+            for word in spl.strip().split(' '):
+                if word:
+                    result_list.extend(self._normalize_date(word))
+        return result_list
+
+    def _is_email(self, utterance_list):
+        utt_list = []
+        for word in utterance_list:
+            b, w, a = "", word, ""
+            if word[0] in self.puncts:
+                b, w = w[0], w[1:]
+            if w and word[-1] in self.puncts:
+                a, w = w[-1], w[:-1]
+            utt_list.append(b+w+a)
+        return utt_list
+
+    def _remove_not_allowed_characters(self, utt):
+        allowed = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789"
+        new_utt = ""
+        for c in utt:
+            if c in allowed:
+                new_utt += c
+            elif c.isalpha() or c.isdigit() or not c.strip() or c in self.puncts or c=="'":
+                if len(new_utt)>1 and c in self.puncts and not new_utt[-1].strip():
+                    new_utt = new_utt[:-1]
+                new_utt += c
+            else:
+                new_utt += " "
+        return new_utt
+
+    def _remove_successive_puncts(self, utt):
+        n = ""
+        for i, c in enumerate(utt.strip()):
+            if i>0 and ((n[-1]==" " and c==" ") or (n[-1] in self.puncts and c in self.puncts)):
+                continue
+            n += c
+        return n
+
+    def _correct_spacing(self, word):
+        for p in "?.,!":
+            word = word.replace(p, f"{p} ")
+            word = word.replace(f" {p}", p)
+        return word.strip()
+
+    def normalize(self, utt):
+        utt = self._pre_normalize(utt)
+        utt = self._custom_changes(utt)
+        utt = self._remove_emojis(utt)
+        utt = " ".join(self._is_email(self._split_ssml_tags(utt)))
+        utt = self._remove_not_allowed_characters(utt)
+        utt = self._correct_spacing(self._remove_successive_puncts(utt))
+        while "  " in utt:
+            utt = utt.replace("  ", " ")
+        return utt
+
+
+def synthetic_utterances(n: int, seed: int = 0):
+    """
+    English utterances of 5-40 words with punctuation, emojis, ssml tags, dates and e-mail addresses,
+    separated by spaces and newlines. Tags are sometimes written against the words next to them.
+    """
+    rnd = random.Random(seed)
+    words = ["the", "order", "will", "arrive", "on", "Monday", "please", "call", "us", "at", "support",
+             "thank", "you", "for", "waiting", "your", "account", "is", "ready", "Let’s", "go", "R&D", "team"]
+    tags = ["<break time='1s'/>", "<speak>", "</speak>", "<p>", "</p>", "<say-as interpret-as='date'>", "</say-as>"]
+    extras = ["😊", "🌍", *tags, "12/05/2023", "3-11-24", "17/06/2024", "john.doe@example.com", "#hashtag", "**", "…"]
+    puncts = ["", "", "", "", ",", ".", "!", "?", "!!", " ,", " ."]
+    seps = [" "]*12+["  ", "\n", " \n", "\n\n"]
+    out = []
+    for _ in range(n):
+        text, prev = "", None
+        for _ in range(rnd.randint(5, 40)):
+            tok = rnd.choice(extras) if rnd.random()<0.12 else rnd.choice(words)
+            if prev is not None:
+                text += "" if (tok in tags or prev in tags) and rnd.random()<0.5 else rnd.choice(seps)
+            text += tok+("" if tok in tags and rnd.random()<0.7 else rnd.choice(puncts))
+            prev = tok
+        out.append(text)
+    return out
+
+
+def bench_text_normalizer(utterances: int = 5000, runs: int = 3, workers: int = 1):
+    """
+    Utterances per second of the notebook's TextNormalizer passes against text_normalizer.
+    """
+    from text_normalizer import TextNormalizer
+
+    utts = synthetic_utterances(int(utterances))
+    # "R&D" only matches before "&" is converted
+    cust_pron = {"R&D": "research and development", "Let’s": "let us"}
+    naive = _NotebookNormalizer(cust_pron=cust_pron)
+    fast = TextNormalizer("english", cust_pron=cust_pron)
+    expected = [naive.normalize(u) for u in utts]
+    got = fast.normalize_many(utts, workers=int(workers))
+    if got!=expected:
+        bad = next(i for i, (a, b) in enumerate(zip(got, expected)) if a!=b)
+        com.RaiseError(AssertionError, f"text_normalizer differs from the notebook passes on {utts[bad]!r}: {got[bad]!r} != {expected[bad]!r}", logger)
+
+    res = []
+    for name, fn in [("notebook_normalizer", lambda: [naive.normalize(u) for u in utts]),
+                     ("text_normalizer", lambda: fast.normalize_many(utts, workers=int(workers)))]:
+        timings = []
+        for _ in range(int(runs)):
+            t = time.perf_counter()
+            fn()
+            timings.append(time.perf_counter()-t)
+        r = _summary(f"{name}_{len(utts)}", timings)
+        r["utterances_per_sec"] = round(len(utts)/r["mean"], 1)
+        res.append(r)
+    return res
+
+
+def _naive_edit_distance(a: list, b: list):
+    prev = list(range(len(b)+1))
+    for i, x in enumerate(a, 1):
+        cur = [i]
+        for j, y in enumerate(b, 1):
+            cur.append(min(prev[j]+1, cur[j-1]+1, prev[j-1]+(x!=y)))
+        prev = cur
+    return prev[-1]
+
+
+def _per_pair_scores(references: list, hypotheses: list):
+    # the notebook's approach, one jiwer call per sentence pair, or a pure Python DP without jiwer
+    try:
+        import jiwer
+        return [(jiwer.wer(r, h), jiwer.cer(r, h)) for r, h in zip(references, hypotheses)]
+    except ImportError:
+        from wer_cer import words, chars
+        out = []
+        for r, h in zip(references, hypotheses):
+            rw, rc = words(r), chars(r)
+            out.append((_naive_edit_distance(rw, words(h))/len(rw) if rw else len(words(h)),
+                        _naive_edit_distance(rc, chars(h))/len(rc) if rc else len(chars(h))))
+        return out
+
+
+def synthetic_transcripts(n: int, length: int = 20, error_rate: float = 0.15, vocab: int = 5000, seed: int = 0):
+    """
+    Reference sentences of about `length` words and hypotheses with substituted, deleted and
+    inserted words at `error_rate`.
+    """
+    rnd = random.Random(seed)
+    vocabulary = ["".join(rnd.choice("abcdefghiklmnorstuy") for _ in range(rnd.randint(2, 9))) for _ in range(vocab)]
+    refs, hyps = [], []
+    for _ in range(n):
+        ref = [rnd.choice(vocabulary) for _ in range(max(1, int(rnd.gauss(length, length/4))))]
+        hyp = []
+        for w in ref:
+            r = rnd.random()
+            if r<error_rate/3:
+                hyp.append(rnd.choice(vocabulary))
+            elif r<2*error_rate/3:
+                continue
+            elif r<error_rate:
+                hyp.extend([w, rnd.choice(vocabulary)])
+            else:
+                hyp.append(w)
+        refs.append(" ".join(ref))
+        hyps.append(" ".join(hyp))
+    return refs, hyps
+
+
+def bench_wer_cer(pairs: int = 500, length: int = 20, workers: int = 1, runs: int = 3):
+    """
+    Per-pair scoring as in WER_AND_CER.ipynb against wer_cer.evaluate with each kernel.
+    """
+    import wer_cer
+
+    refs, hyps = synthetic_transcripts(int(pairs), int(length))
+    expected = _per_pair_scores(refs, hyps)
+    res = []
+    cases = [("per_pair", lambda: _per_pair_scores(refs, hyps))]
+    cases += [(f"evaluate_{k}", lambda k=k: wer_cer.evaluate(refs, hyps, kernel=k, workers=int(workers))) for k in wer_cer.KERNELS]
+    for name, fn in cases:
+        timings = []
+        for _ in range(int(runs)):
+            t = time.perf_counter()
+            out = fn()
+            timings.append(time.perf_counter()-t)
+        if name!="per_pair" and list(zip(out["utterance_wer"], out["utterance_cer"]))!=expected:
+            com.RaiseError(AssertionError, f"{name} scores differ from the per-pair scores", logger)
+        r = _summary(f"{name}_{len(refs)}x{length}", timings)
+        r["pairs_per_sec"] = round(len(refs)/r["mean"], 1)
+        res.append(r)
+    return res
+
+
+BENCHMARKS = {
+    "mms_fa_warm": bench_mms_fa_warm,
+    "batch_emissions": check_batch_emissions,
+    "startup": bench_startup,
+    "word_phone_join": bench_word_phone_join,
+    "viterbi": bench_viterbi,
+    "gesture_weights": bench_gesture_weights,
+    "context_gestures": bench_context_gestures,
+    "frame_timeline": bench_frame_timeline,
+    "alignment_cache": bench_alignment_cache,
+    "alignment_service": bench_alignment_service,
+    "suite": bench_suite,
+    "text_normalizer": bench_text_normalizer,
+    "wer_cer": bench_wer_cer,
+    "compare": bench_compare,
+}
+
+
+if __name__=="__main__":
+    name, *args = sys.argv[1:]
+    print(BENCHMARKS[name](*args))
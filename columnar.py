@@ -0,0 +1,198 @@
+import os
+import json
+
+import numpy as np
+
+import common as com
+
+logger = com.get_logger(__name__)
+
+COLUMNAR_EXTS = (".npz", ".parquet")
+
+# column kinds: numbers, ids into the shared string table, or json encoded values of mixed types
+_NUMERIC = (int, float)
+
+
+class StringTable:
+    """
+    Interned strings, phone, word and gesture names are stored once and referenced by int32 id.
+    """
+    def __init__(self, strings: list = None):
+        self.strings = list(strings or [])
+        self.ids = {s: i for i, s in enumerate(self.strings)}
+
+    def intern(self, s: str):
+        i = self.ids.get(s)
+        if i is None:
+            i = self.ids[s] = len(self.strings)
+            self.strings.append(s)
+        return i
+
+
+def _is_number(v):
+    return isinstance(v, _NUMERIC) and not isinstance(v, bool)
+
+
+def _column_kind(values: list):
+    if all(isinstance(v, int) and not isinstance(v, bool) for v in values):
+        return "i8"
+    if all(_is_number(v) for v in values):
+        return "f8"
+    if all(isinstance(v, str) for v in values):
+        return "str"
+    return "json"
+
+
+def _split_header(rows: list):
+    # a first row of strings above rows that are not all strings, like the frames.csv header
+    if len(rows)>1 and all(isinstance(v, str) for v in rows[0]) and not all(isinstance(v, str) for v in rows[1]):
+        return list(rows[0]), rows[1:]
+    return None, rows
+
+
+def _encode_rows(rows: list, strings: StringTable):
+    header, rows = _split_header(rows)
+    width = len(rows[0]) if rows else 0
+    if any(len(r)!=width for r in rows):
+        com.RaiseError(ValueError, "only rectangular tables can be stored in a columnar format", logger)
+
+    columns = [[r[i] for r in rows] for i in range(width)]
+    kinds = [_column_kind(c) for c in columns]
+    dtype = [(f"c{i}", "i4" if k in ("str", "json") else k) for i, k in enumerate(kinds)]
+    table = np.zeros(len(rows), dtype=dtype)
+    for i, (col, kind) in enumerate(zip(columns, kinds)):
+        if kind=="str":
+            col = [strings.intern(v) for v in col]
+        elif kind=="json":
+            col = [strings.intern(json.dumps(v)) for v in col]
+        table[f"c{i}"] = col
+    return table, {"header": header, "kinds": kinds}
+
+
+def _decode_rows(table: np.ndarray, info: dict, strings: list):
+    columns = []
+    for i, kind in enumerate(info["kinds"]):
+        col = table[f"c{i}"].tolist()
+        if kind=="str":
+            col = [strings[j] for j in col]
+        elif kind=="json":
+            col = [json.loads(strings[j]) for j in col]
+        columns.append(col)
+    rows = [list(r) for r in zip(*columns)]
+    if info["header"] is not None:
+        rows.insert(0, info["header"])
+    return rows
+
+
+def _is_table(v):
+    return isinstance(v, list) and all(isinstance(r, (list, tuple)) for r in v)
+
+
+def to_arrays(data):
+    """
+    Columnar form of the rows (frames.csv, phonemes.csv) or dict of row tables (mfa_output.json)
+    passed between the stages: one numpy structured array per table, the interned string table and
+    a small json description. Stages can hand this to each other in memory; from_arrays reverses it.
+    """
+    strings = StringTable()
+    arrays = {}
+    if isinstance(data, dict):
+        meta = {"kind": "dict", "keys": list(data), "values": {}, "tables": {}}
+        for k, v in data.items():
+            if _is_table(v):
+                arrays[f"t:{k}"], meta["tables"][k] = _encode_rows(v, strings)
+            else:
+                meta["values"][k] = v
+    elif _is_table(data):
+        arrays["t:"], info = _encode_rows(data, strings)
+        meta = {"kind": "rows", "table": info}
+    else:
+        com.RaiseError(TypeError, f"cannot store data of type '{type(data).__name__}' in a columnar format", logger)
+
+    arrays["__strings__"] = np.array(strings.strings, dtype=str)
+    arrays["__meta__"] = np.array(json.dumps(meta))
+    return arrays
+
+
+def from_arrays(arrays):
+    meta = json.loads(str(arrays["__meta__"]))
+    strings = arrays["__strings__"].tolist()
+    if meta["kind"]=="rows":
+        return _decode_rows(arrays["t:"], meta["table"], strings)
+    data = {}
+    for k in meta["keys"]:
+        if k in meta["tables"]:
+            data[k] = _decode_rows(arrays[f"t:{k}"], meta["tables"][k], strings)
+        else:
+            data[k] = meta["values"][k]
+    return data
+
+
+def _save_parquet(path: str, data):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    if not _is_table(data):
+        com.RaiseError(ValueError, f"parquet holds a single table, use .npz for '{os.path.basename(path)}'", logger)
+    header, rows = _split_header(data)
+    width = len(rows[0]) if rows else 0
+    names = header or [f"c{i}" for i in range(width)]
+    columns = {}
+    kinds = []
+    for i, name in enumerate(names):
+        col = [r[i] for r in rows]
+        kind = _column_kind(col)
+        if kind=="json":
+            col = [json.dumps(v) for v in col]
+        kinds.append(kind)
+        # dictionary encoding is arrow's own interned string table
+        columns[name] = pa.array(col).dictionary_encode() if kind in ("str", "json") else pa.array(col)
+    table = pa.table(columns, metadata={"columnar": json.dumps({"header": header, "kinds": kinds})})
+    pq.write_table(table, path)
+
+
+def _read_parquet(path: str):
+    import pyarrow.parquet as pq
+
+    table = pq.read_table(path)
+    info = json.loads(table.schema.metadata[b"columnar"])
+    columns = []
+    for kind, col in zip(info["kinds"], table.columns):
+        col = col.to_pylist()
+        if kind=="json":
+            col = [json.loads(v) for v in col]
+        columns.append(col)
+    rows = [list(r) for r in zip(*columns)]
+    if info["header"] is not None:
+        rows.insert(0, info["header"])
+    return rows
+
+
+def save_file(path: str, data, logger=logger):
+    """
+    Drop in for com.save_file: .npz and .parquet paths are written in the columnar format,
+    everything else goes to com.save_file.
+    """
+    ext = os.path.splitext(str(path))[1].lower()
+    if ext==".npz":
+        # written through a file object so numpy does not append another .npz
+        with open(path, "wb") as f:
+            np.savez(f, **to_arrays(data))
+    elif ext==".parquet":
+        _save_parquet(path, data)
+    else:
+        return com.save_file(path, data, logger)
+    return path
+
+
+def read_file(path: str, logger=logger):
+    """
+    Drop in for com.read_file that also reads the .npz and .parquet files written by save_file.
+    """
+    ext = os.path.splitext(str(path))[1].lower()
+    if ext==".npz":
+        with np.load(path, allow_pickle=False) as arrays:
+            return from_arrays(arrays)
+    if ext==".parquet":
+        return _read_parquet(path)
+    return com.read_file(path, logger)
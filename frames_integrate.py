@@ -1,8 +1,13 @@
 import os
 import sys
+import json
+import time
+import zlib
+import bisect
 import random
-import librosa
-from copy import deepcopy
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
 
 # # Append the current directory (where frames.py is located)
 # sys.path.append(os.getcwd())
@@ -33,29 +38,189 @@ else:
 
 
 
+import audio_io
+import columnar
+import metrics
+
 logger = com.get_logger(__name__)
 FRAMES_DEFAULTS = com.read_file(f"{com.ASSETS}/frames_defaults.json", logger)
 
-class Frames:
-    def __init__(self, voice_path: str, phonemes_path: str, **kwargs):
-        output_dir = com.hp.dirname(voice_path)
-        self.audio_duration = librosa.get_duration(path=voice_path)
-        self.frame_rate = kwargs.get('frame_rate', com.FRAME_RATE)
 
-        self.phonemes = com.read_file(phonemes_path, logger)
-        self.frames_path = output_dir + '/frames.csv'
-        try:
-            params = deepcopy(kwargs.pop("gesture_params", {}).pop('params', {}) or FRAMES_DEFAULTS[kwargs.pop("default_gestures", "old")])
-        except KeyError:
-            com.RaiseError(KeyError, f"'default_gestures' must be either 'old', 'male' or 'female'", logger)
-    
+class _WeightTree:
+    """
+    Fenwick tree over integer weights, for sampling an index with probability proportional
+    to its weight and updating a weight in O(log n).
+    """
+    def __init__(self, weights: list):
+        self.n = len(weights)
+        self.weights = list(weights)
+        self.total = sum(weights)
+        self._tree = [0]*(self.n+1)
+        for i, w in enumerate(weights, 1):
+            self._tree[i] += w
+            j = i + (i & -i)
+            if j<=self.n:
+                self._tree[j] += self._tree[i]
+
+    def add(self, i: int, delta: int):
+        self.weights[i] += delta
+        self.total += delta
+        i += 1
+        while i<=self.n:
+            self._tree[i] += delta
+            i += i & -i
+
+    def sample(self, u: float):
+        # smallest index whose cumulative weight exceeds u*total
+        target = u*self.total
+        pos = 0
+        step = 1 << self.n.bit_length()
+        while step:
+            nxt = pos+step
+            if nxt<=self.n and self._tree[nxt]<=target:
+                pos = nxt
+                target -= self._tree[nxt]
+            step >>= 1
+        return min(pos, self.n-1)
+
+class FrameTimeline:
+    """
+    Gesture start times as parallel arrays, float64 seconds and int32 ids into an interned table of
+    gesture names, grown by doubling. Sorting, collision nudging and quantization to frame indices
+    run over the whole arrays.
+    """
+    def __init__(self, capacity: int = 64):
+        self.names = columnar.StringTable()
+        self._times = np.empty(max(1, capacity), dtype=np.float64)
+        self._ids = np.empty(max(1, capacity), dtype=np.int32)
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def _reserve(self, n: int):
+        if self.size+n>len(self._times):
+            capacity = max(self.size+n, 2*len(self._times))
+            for attr in ("_times", "_ids"):
+                old = getattr(self, attr)
+                new = np.empty(capacity, dtype=old.dtype)
+                new[:self.size] = old[:self.size]
+                setattr(self, attr, new)
+
+    def add(self, t: float, name: str):
+        self._reserve(1)
+        self._times[self.size] = t
+        self._ids[self.size] = self.names.intern(name)
+        self.size += 1
+
+    def extend(self, times, names: list):
+        """
+        Appends many entries at once, for example the gestures of another track.
+        """
+        times = np.asarray(times, dtype=np.float64)
+        ids = np.fromiter((self.names.intern(n) for n in names), dtype=np.int32, count=len(times))
+        self._reserve(len(times))
+        self._times[self.size:self.size+len(times)] = times
+        self._ids[self.size:self.size+len(times)] = ids
+        self.size += len(times)
+
+    @property
+    def times(self):
+        return self._times[:self.size]
+
+    @property
+    def ids(self):
+        return self._ids[:self.size]
+
+    def rows(self):
+        """
+        [timestamp, name] of every entry in insertion order.
+        """
+        names = self.names.strings
+        return [[t, names[i]] for t, i in zip(self.times.tolist(), self.ids.tolist())]
+
+    def take(self, before: float):
+        """
+        Moves the entries starting before `before` into a new timeline sharing the name table,
+        for handing on the settled part of a timeline that is still growing.
+        """
+        settled = self.times<before
+        n = int(settled.sum())
+        out = FrameTimeline(n)
+        out.names = self.names
+        out._times[:n] = self.times[settled]
+        out._ids[:n] = self.ids[settled]
+        out.size = n
+        keep = ~settled
+        self._times[:self.size-n] = self.times[keep]
+        self._ids[:self.size-n] = self.ids[keep]
+        self.size -= n
+        return out
+
+    def resolved(self, frame_rate: int, after: float = None):
+        """
+        Times and ids sorted by time, ties kept in insertion order, with every entry that starts
+        at the final time of the one before it moved one frame later. An entry after a moved one
+        is only moved when it starts one frame after the previous start, so within a run of
+        entries that each either repeat or follow the previous start by a frame, whether an entry
+        moves is the parity of the repeats since the run began. `after` is the final time of the
+        last entry resolved before these, for timelines resolved piece by piece.
+        """
+        order = np.argsort(self.times, kind="stable")
+        times, ids = self.times[order], self.ids[order]
+        if after is not None:
+            # an entry that is never moved, whose time is the final time of the previous piece
+            times = np.concatenate(([after], times))
+        if len(times)>=2:
+            step = 1/frame_rate
+            same = times[1:]==times[:-1]
+            next_frame = times[1:]==times[:-1]+step
+            run_start = np.concatenate(([True], ~(same | next_frame)))
+            repeats = np.concatenate(([0], np.cumsum(same)))
+            first = np.maximum.accumulate(np.where(run_start, np.arange(len(times)), 0))
+            moved = (repeats-repeats[first])%2==1
+            times = np.where(moved, times+step, times)
+        return (times[1:] if after is not None else times), ids
+
+    def frame_indices(self, frame_rate: int, after: int = None):
+        """
+        Frame indices and ids sorted by time, ties kept in insertion order. The starts are
+        quantized to the nearest frame first and every index that is not past the one before it
+        is moved to the next free frame, so the indices are unique and increasing even for starts
+        less than a frame apart: index i is max over j<=i of frames[j]+(i-j). `after` is the last
+        index of a piece resolved before these.
+        """
+        order = np.argsort(self.times, kind="stable")
+        # rounding keeps the time order
+        frames = np.rint(self.times[order]*frame_rate).astype(np.int64)
+        ids = self.ids[order]
+        if after is not None:
+            frames = np.concatenate(([after], frames))
+        steps = np.arange(len(frames))
+        frames = np.maximum.accumulate(frames-steps)+steps
+        return (frames[1:] if after is not None else frames), ids
+
+
+def _fold(word):
+    return word.casefold() if isinstance(word, str) else word
+
+
+class GestureProfile:
+    """
+    Validated gesture parameters (old/male/female defaults or custom `gesture_params`) with their
+    durations at one frame rate. It is compiled once, is immutable and picklable, and every Frames
+    built from it gets its own mutable weights.
+    """
+    __slots__ = ("frame_rate", "gestures", "talk_head", "non_talk_head", "talk_anim", "hand_anim",
+                 "talk_head_by_duration", "non_talk_head_by_duration", "context_gestures",
+                 "context_index", "context_index_folded")
+
+    def __init__(self, params: dict, frame_rate: int):
+        params = dict(params)
         context_gestures = params.pop('context_gestures', [])
-        self.non_context_gestures = params
-        self._talk_head = {}
-        self._non_talk_head = {}
-        self._talk_anim = []
-        self._hand_anim = []
-        for gest, gest_vals in self.non_context_gestures.copy().items():
+        gestures = []
+        talk_head, non_talk_head, talk_anim, hand_anim = [], [], [], []
+        for gest, gest_vals in params.items():
             if not isinstance(gest_vals, dict):
                 err = f"received gesture value parameters of type '{type(gest_vals).__name__}' instead of dict with keys weight and frames"
                 com.RaiseError(TypeError, err, logger)
@@ -63,106 +228,209 @@ class Frames:
             if "frames" not in gest_vals or "weight" not in gest_vals:
                 err = f"key 'frames' is missing in gesture params"
                 com.RaiseError(ValueError, err, logger)
-            self.non_context_gestures[gest]['duration'] = round(gest_vals['frames']/self.frame_rate, 2)
-            
+
+            if not isinstance(gest_vals["weight"], int):
+                err = f"weight of gesture '{gest}' should be an integer"
+                com.RaiseError(ValueError, err, logger)
+            gestures.append((gest, gest_vals["frames"], gest_vals["weight"], round(gest_vals['frames']/frame_rate, 2)))
+
             if gest.startswith('talk_head'):
-                self._talk_head[gest] = gest_vals
+                talk_head.append(gest)
             elif "talk" in gest:
-                self._talk_anim.append(gest)
-                self._non_talk_head[gest] = gest_vals
+                talk_anim.append(gest)
+                non_talk_head.append(gest)
             elif "hand" in gest:
-                self._hand_anim.append(gest)
-                self._non_talk_head[gest] = gest_vals
-        
-        self.context_gestures = []        
+                hand_anim.append(gest)
+                non_talk_head.append(gest)
+
+        contexts = []
         if isinstance(context_gestures, dict):
             for k, v in context_gestures.items():
-                self.context_gestures.append([k, v["frames"], v["words"]])        
-        if isinstance(self.context_gestures, list):
-            for i, gest in enumerate(self.context_gestures):
-                gest[1] = round(gest[1]/self.frame_rate, 2)
-                self.context_gestures[i] = gest
+                contexts.append((k, round(v["frames"]/frame_rate, 2), tuple(v["words"])))
+
+        # word -> positions of the context gestures listing it, in catalogue order
+        context_index, context_index_folded = {}, {}
+        for i, (_, _, words) in enumerate(contexts):
+            for w in words:
+                for index, key in [(context_index, w), (context_index_folded, _fold(w))]:
+                    positions = index.setdefault(key, [])
+                    if not positions or positions[-1]!=i:
+                        positions.append(i)
+
+        # gestures of each group sorted by duration, so that the ones fitting a time range are a bisect away
+        by_gesture = {g[0]: g for g in gestures}
+        def by_duration(names):
+            names = sorted((g for g in names if by_gesture[g][2]>=1), key=lambda g: by_gesture[g][3])
+            return tuple(names), tuple(by_gesture[g][3] for g in names)
+
+        set_ = super().__setattr__
+        set_("frame_rate", frame_rate)
+        set_("gestures", tuple(gestures))
+        set_("talk_head", tuple(talk_head))
+        set_("non_talk_head", tuple(non_talk_head))
+        set_("talk_anim", tuple(talk_anim))
+        set_("hand_anim", tuple(hand_anim))
+        set_("talk_head_by_duration", by_duration(talk_head))
+        set_("non_talk_head_by_duration", by_duration(non_talk_head))
+        set_("context_gestures", tuple(contexts))
+        set_("context_index", {k: tuple(v) for k, v in context_index.items()})
+        set_("context_index_folded", {k: tuple(v) for k, v in context_index_folded.items()})
+
+    def __setattr__(self, name, value):
+        raise AttributeError("GestureProfile is immutable")
+
+    def __getstate__(self):
+        return {k: getattr(self, k) for k in self.__slots__}
+
+    def __setstate__(self, state):
+        for k, v in state.items():
+            super().__setattr__(k, v)
+
+    @classmethod
+    def from_kwargs(cls, frame_rate: int, gesture_params: dict=None, default_gestures: str="old"):
+        params = (gesture_params or {}).get('params', {})
+        if params:
+            return cls(params, frame_rate)
+        return get_default_profile(default_gestures, frame_rate)
+
+
+_default_profiles = {}
+
+
+def get_default_profile(name: str, frame_rate: int):
+    key = (name, frame_rate)
+    if key not in _default_profiles:
+        if name not in FRAMES_DEFAULTS:
+            com.RaiseError(KeyError, f"'default_gestures' must be either 'old', 'male' or 'female'", logger)
+        _default_profiles[key] = GestureProfile(FRAMES_DEFAULTS[name], frame_rate)
+    return _default_profiles[key]
+
+
+class Frames:
+    def __init__(self, voice_path: str, phonemes_path, **kwargs):
+        """
+        `phonemes_path` is either the phonemes.csv path or an iterable of its rows, for example
+        Mfa_output.stream_phoneme_rows(), which is then consumed incrementally by frames(), or by
+        stream_frame_rows() to get the frames rows while the phoneme rows are still arriving.
+        A compiled GestureProfile can be passed as `profile` instead of `gesture_params`/`default_gestures`.
+        With `audio_duration` given, voice_path may be None and only frame_rows() is available.
+        With `context_case_insensitive` the words of context gestures match regardless of case.
+        With `frame_index` the rows hold frame indices under a "frame" header instead of seconds.
+        `frames_format` is 'csv' (default), 'npz' or 'parquet'.
+        """
+        self.audio_duration = kwargs.get("audio_duration") or audio_io.get_duration(voice_path)
+        self.frame_rate = kwargs.get('frame_rate', com.FRAME_RATE)
+
+        if isinstance(phonemes_path, (str, os.PathLike)):
+            self.phonemes = columnar.read_file(phonemes_path, logger)
+        else:
+            self.phonemes = phonemes_path
+        self.frames_path = None
+        if voice_path is not None:
+            self.frames_path = com.hp.dirname(voice_path) + f"/frames.{kwargs.get('frames_format', 'csv')}"
+        profile = kwargs.get("profile") or GestureProfile.from_kwargs(
+            self.frame_rate, kwargs.get("gesture_params"), kwargs.get("default_gestures", "old"))
+        if profile.frame_rate!=self.frame_rate:
+            com.RaiseError(ValueError, f"gesture profile was compiled for {profile.frame_rate} fps instead of {self.frame_rate}", logger)
+
+        # the weights are used up while gestures are placed, so each instance gets its own copy
+        self.non_context_gestures = {g: {"frames": f, "weight": w, "duration": d} for g, f, w, d in profile.gestures}
+        self._talk_head = {g: self.non_context_gestures[g] for g in profile.talk_head}
+        self._non_talk_head = {g: self.non_context_gestures[g] for g in profile.non_talk_head}
+        self._talk_anim = list(profile.talk_anim)
+        self._hand_anim = list(profile.hand_anim)
+        self._by_duration = {True: profile.talk_head_by_duration, False: profile.non_talk_head_by_duration}
+        self.context_gestures = [[g, dur, list(words)] for g, dur, words in profile.context_gestures]
+        self._fold_words = kwargs.get("context_case_insensitive", False)
+        self._context_index = profile.context_index_folded if self._fold_words else profile.context_index
         logger.info(f"Context gestures are {self.context_gestures}")
-        self.frames_list = [["timestamp", "animation"]]        
+        self.frame_index = kwargs.get("frame_index", False)
+        self.timeline = FrameTimeline()
+
+    @property
+    def frames_list(self):
+        # the placed gestures in the older [header, *rows] list layout
+        return [["timestamp", "animation"]] + self.timeline.rows()
 
 
-    def _fit_list(self, time_diff: int, gestures: dict):
+    def _fit_list(self, time_diff: float, gestures: dict, talk_head: bool):
         """
         Function to find the gestures that fit within a particular duration.
+        Returns them shortest first, only the ones still available in `gestures`.
         """
-        fits = []
-        for a, b in gestures.copy().items():
-            w = b["weight"]
-            if not isinstance(w, int):
-                err = f"weight of gesture '{a}' should be an integer"
-                com.RaiseError(ValueError, err, logger)
-        
-            if w<1:
-                gestures.pop(a)
-            elif b["duration"]<=time_diff:
-                fits.append(a)
+        names, durations = self._by_duration[talk_head]
+        return [a for a in names[:bisect.bisect_right(durations, time_diff)] if a in gestures]
+
 
-        l = []
-        for a in fits:
-            l.extend([a,]*int(gestures[a]['weight']))
-        return l
+    def _generate_combo(self, candidates: list, target_dur: float, gestures: dict, talk_head: bool = False):
+        """
+        Walks the candidates in the random order of a shuffled list holding every gesture `weight`
+        times and keeps each one that still fits. The order is drawn lazily, one copy at a time in
+        proportion to the copies left, so the cost no longer grows with the weights:
+        a gesture longer than the remaining duration can never fit again and loses all its copies,
+        and the walk stops once no candidate could be kept, since that only changes when one is kept.
+        """
+        alternate = not talk_head and self._hand_anim and self._talk_anim
+        durations = [gestures[a]["duration"] for a in candidates]
+        talks = ["talk" in a for a in candidates]
+        copies = _WeightTree([gestures[a]["weight"] for a in candidates])
 
+        def can_keep(i):
+            if not copies.weights[i] or s+durations[i]>target_dur:
+                return False
+            if talk_head:
+                return True
+            return candidates[i] not in prev_3 and not (alternate and talks[i]==prev_talk)
 
-    def _generate_combo(self, selected_gestures: list, target_dur: int, gestures: dict):
         g = []
         s = 0
         prev_talk = None
         prev_3 = []
-        for a in selected_gestures:
-            dur = gestures[a]["duration"]
-            if s+dur>target_dur or a in prev_3:
+        # whether a candidate can be kept only changes when one is kept
+        more = any(can_keep(i) for i in range(len(candidates)))
+        while more:
+            i = copies.sample(random.random())
+            a = candidates[i]
+            if s+durations[i]>target_dur:
+                copies.add(i, -copies.weights[i])
                 continue
-
-            if self._hand_anim and self._talk_anim:
-                talk = True if "talk" in a else False
-                if talk==prev_talk:
+            copies.add(i, -1)
+            if not talk_head:
+                if a in prev_3:
+                    continue
+                if alternate and talks[i]==prev_talk:
                     continue
-            
-            if s+dur<=target_dur:
-                s+=dur
-                g.append(a)
-                prev_talk = False
-                if "talk" in a:
-                    prev_talk=True
-                prev_3.append(a)
-                if len(prev_3)>3:
-                    prev_3.pop(0)
-    
-                w = gestures[a]['weight']-1
-                if w==0:
-                    gestures.pop(a)
-                else:
-                    gestures[a]['weight'] = w
-        return g, gestures
 
-    def _generate_combo_talk_head(self, selected_gestures: list, target_dur: int, gestures: dict):
-        g = []
-        s = 0
-        prev_3 = []
-        for a in selected_gestures:
-            dur = gestures[a]["duration"]
-            if s+dur>target_dur:
-                continue
-            
-            if s+dur<=target_dur:
-                s+=dur
-                g.append(a)
-                prev_3.append(a)
-                if len(prev_3)>3:
-                    prev_3.pop(0)
-    
-                w = gestures[a]['weight']-1
-                if w==0:
-                    gestures.pop(a)
-                else:
-                    gestures[a]['weight'] = w
+            s+=durations[i]
+            g.append(a)
+            prev_talk = talks[i]
+            prev_3.append(a)
+            if len(prev_3)>3:
+                prev_3.pop(0)
+
+            w = gestures[a]['weight']-1
+            if w==0:
+                gestures.pop(a)
+            else:
+                gestures[a]['weight'] = w
+            more = any(can_keep(i) for i in range(len(candidates)))
         return g, gestures
 
+    def _generate_combo_talk_head(self, candidates: list, target_dur: float, gestures: dict):
+        return self._generate_combo(candidates, target_dur, gestures, talk_head=True)
+
+    def _fill_range(self, sta: float, time_diff: float, gest: dict, talk_head: bool):
+        l = self._fit_list(time_diff, gest, talk_head)
+        if not l:
+            return
+        if talk_head:
+            ge, gest = self._generate_combo_talk_head(l, time_diff, gest)
+        else:
+            ge, gest = self._generate_combo(l, time_diff, gest)
+        for g in ge:
+            self.timeline.add(round(sta, 2), g)
+            sta+=self.non_context_gestures[g]["duration"]
+
     def _non_context_gestures(self, time_ranges: list, talk_head: bool):
         if talk_head:
             gest = self._talk_head.copy()
@@ -172,78 +440,224 @@ class Frames:
         sorted_times = sorted(time_ranges, key=lambda x: x[1] - x[0])
         new_time_ranges = {tuple(v): v[1]-v[0] for v in sorted_times}
         for k, v in new_time_ranges.items():
-            l = self._fit_list(v, gest)
-            if not l:
-                ge = gest.copy()
-                l = self._fit_list(v, ge)
-                if not l:
-                    continue
-                gest = ge
-
-            l = random.sample(l, len(l))
-            if talk_head:
-                ge, gest = self._generate_combo_talk_head(l, v, gest)
-            else:
-                ge, gest = self._generate_combo(l, v, gest)
-            sta = k[0]
-            for g in ge:
-                self.frames_list.append([round(sta, 2), g])
-                sta+=self.non_context_gestures[g]["duration"]
-
+            self._fill_range(k[0], v, gest, talk_head)
 
-    def _context_gestures(self):
-        non_context_ranges = []
-        w_l = []
+    def _context_ranges(self):
+        """
+        Places the context gestures while reading the phoneme rows and yields every [start, end]
+        range left between them as soon as the next context gesture closes it. Only the words seen
+        so far and the end of the last context gesture are carried from row to row.
+        """
+        w_l = set()
         st = 0
-        for i, l in enumerate(self.phonemes):
-            if i==0:
-                ge_end = 0
-
+        ge_end = 0
+        end = None
+        for l in self.phonemes:
             if ge_end>=self.audio_duration:
                 break
 
             w, sta, end = l[3:6]
+            if self._fold_words:
+                w = _fold(w)
             if w not in w_l:
-                w_l.append(w)
-                for ge, dur, words in self.context_gestures:
-                    if w in words:
-                        if sta>=ge_end:
-                            ge_end = sta+dur
-                            if ge_end>self.audio_duration:                                
-                                ge_end = self.audio_duration
-                                sta = round(ge_end-dur, 2)
-                            self.frames_list.append((round(sta, 2), ge))
-                            non_context_ranges.append([st, sta])
-                            st = ge_end
-                        break
-                    
-            if i==len(self.phonemes)-1:
+                w_l.add(w)
+                # only the first context gesture listing the word is considered
+                positions = self._context_index.get(w)
+                if positions:
+                    ge, dur, _ = self.context_gestures[positions[0]]
+                    if sta>=ge_end:
+                        ge_end = sta+dur
+                        if ge_end>self.audio_duration:                                
+                            ge_end = self.audio_duration
+                            sta = round(ge_end-dur, 2)
+                        self.timeline.add(round(sta, 2), ge)
+                        yield [st, sta]
+                        st = ge_end
+        else:
+            # the rows may come from a generator, so the last row is handled once they run out
+            if end is not None:
                 if end<self.audio_duration:
                     end = self.audio_duration
                 if st<end:
-                    non_context_ranges.append([st, end])
-        return non_context_ranges
+                    yield [st, end]
 
-    def frames(self):
-        non_context_ranges = self._context_gestures()
-        self._non_context_gestures(non_context_ranges, talk_head=False)
-        if self._talk_head:
-            self._non_context_gestures([[0, self.audio_duration]], talk_head=True)  
+    def _context_gestures(self):
+        return list(self._context_ranges())
+
+    def _resolve(self, timeline: FrameTimeline, frame_index: bool, after=None):
+        # rows of a timeline in time order, the last time or frame index continues in the next piece
+        if frame_index:
+            times, ids = timeline.frame_indices(self.frame_rate, after)
+        else:
+            times, ids = timeline.resolved(self.frame_rate, after)
+        names = timeline.names.strings
+        rows = [[t, names[i]] for t, i in zip(times.tolist(), ids.tolist())]
+        return rows, rows[-1][0] if rows else after
+
+    def _header(self, frame_index: bool):
+        return ["frame" if frame_index else "timestamp", "animation"]
+
+    def frame_rows(self, frame_index: bool = None):
+        """
+        The frames.csv rows, header included, without writing them.
+        """
+        with metrics.span("frames_context_gestures"):
+            non_context_ranges = self._context_gestures()
+        with metrics.span("frames_non_context_gestures"):
+            self._non_context_gestures(non_context_ranges, talk_head=False)
+            if self._talk_head:
+                self._non_context_gestures([[0, self.audio_duration]], talk_head=True)  
         
-        fl = sorted(self.frames_list[1:], key=lambda x: x[0])
-        frames_list = []
-        for i, (t, anim) in enumerate(fl):
-            if i!=0:
-                if t==prev_t:
-                    t = t+1/self.frame_rate
-            frames_list.append([t, anim])
-            prev_t = t
-            
-        frames_list.insert(0, self.frames_list[0])
-        com.save_file(self.frames_path, frames_list, logger)
+        if frame_index is None:
+            frame_index = self.frame_index
+        with metrics.span("frames_sort"):
+            rows, _ = self._resolve(self.timeline, frame_index)
+        return [self._header(frame_index)] + rows
+
+    def stream_frame_rows(self, frame_index: bool = None):
+        """
+        frame_rows() as a generator over streamed phoneme rows, e.g. Mfa_output.stream_phoneme_rows().
+        Each range between context gestures is filled as soon as it closes, and the rows before it
+        are yielded once no later gesture can start ahead of them, so rows come out while the audio
+        is still being aligned. The ranges are filled in time order instead of shortest first and
+        the talk head track is drawn up front, so for the same seed the gestures drawn differ from
+        frame_rows().
+        """
+        if frame_index is None:
+            frame_index = self.frame_index
+        yield self._header(frame_index)
+        if self._talk_head:
+            # the talk head track only depends on the duration, its rows wait in the timeline
+            self._non_context_gestures([[0, self.audio_duration]], talk_head=True)
+        gest = self._non_talk_head.copy()
+        # a context gesture that would run past the audio is pulled back to end with it
+        longest = max((dur for _, dur, _ in self.context_gestures), default=0)
+        latest = round(self.audio_duration-longest, 2)
+        after = None
+        for sta, end in self._context_ranges():
+            if end-sta>0:
+                self._fill_range(sta, end-sta, gest, talk_head=False)
+            # everything placed later starts at or after the end of this range
+            rows, after = self._resolve(self.timeline.take(min(end, latest)), frame_index, after)
+            yield from rows
+        rows, _ = self._resolve(self.timeline.take(np.inf), frame_index, after)
+        yield from rows
+
+    def frames(self):
+        with metrics.request("frames", frames_path=str(self.frames_path)):
+            rows = self.frame_rows()
+            with metrics.span("frames_save"):
+                columnar.save_file(self.frames_path, rows, logger)
         return self.frames_path
 
 
+def phoneme_rows(words: list, phones: list):
+    """
+    phonemes.csv rows, [phone_start, phone_end, phone, word, word_start, word_end], from time sorted
+    word and phone tiers such as the "words" and "phones" of mfa_output.json.
+    """
+    rows = []
+    j = 0
+    for w_sta, w_end, w in words:
+        while j<len(phones) and phones[j][1]<=w_end:
+            p_sta, p_end, p = phones[j]
+            rows.append([p_sta, p_end, p, w, w_sta, w_end])
+            j += 1
+    return rows
+
+
+_worker_profiles = {}
+
+
+def _init_frames_worker(profiles: dict):
+    global _worker_profiles
+    _worker_profiles = profiles
+
+
+def _frames_job(job: tuple):
+    voice_path, phonemes_path, profile_key, seed, frame_rate, frames_format, frame_index = job
+    random.seed(seed)
+    f = Frames(voice_path, phonemes_path, profile=_worker_profiles[profile_key], frame_rate=frame_rate,
+               frames_format=frames_format, frame_index=frame_index)
+    return f.frames_path, f.frame_rows()
+
+
+class FramesBatch:
+    """
+    Generates frames.csv for many clips. Each gesture profile is compiled once per batch, clips are
+    spread over a process pool and every clip is seeded from its voice path, so its timeline does
+    not depend on the batch or worker it ran in.
+    """
+    def __init__(self, frame_rate: int = None, workers: int = None, seed: int = 0, frames_format: str = "csv", frame_index: bool = False):
+        self.frame_rate = frame_rate or com.FRAME_RATE
+        self.frames_format = frames_format
+        self.frame_index = frame_index
+        self.workers = workers or os.cpu_count() or 1
+        self.seed = seed
+        self.profiles = {}
+        self.stats = {}
+
+    def profile_key(self, gestures=None):
+        """
+        `gestures` is the name of a default gesture set ('old', 'male' or 'female') or custom
+        gesture params, with or without the {"params": ...} wrapper of `gesture_params`.
+        """
+        if gestures is None or isinstance(gestures, str):
+            key = gestures or "old"
+            if key not in self.profiles:
+                self.profiles[key] = get_default_profile(key, self.frame_rate)
+        else:
+            params = gestures.get("params", gestures)
+            key = "custom_" + str(zlib.crc32(json.dumps(params, sort_keys=True).encode()))
+            if key not in self.profiles:
+                self.profiles[key] = GestureProfile(params, self.frame_rate)
+        return key
+
+    def clip_seed(self, voice_path: str):
+        return zlib.crc32(f"{self.seed}:{voice_path}".encode())
+
+    def run(self, clips: list):
+        """
+        `clips` holds (voice_path, phonemes_path) or (voice_path, phonemes_path, gestures) tuples.
+        Returns the frames.csv paths in the order of `clips`.
+        """
+        jobs = []
+        for voice_path, phonemes_path, *gestures in clips:
+            key = self.profile_key(gestures[0] if gestures else None)
+            jobs.append((voice_path, phonemes_path, key, self.clip_seed(voice_path), self.frame_rate, self.frames_format, self.frame_index))
+
+        t = time.perf_counter()
+        paths = []
+        if self.workers==1 or len(jobs)<2:
+            _init_frames_worker(self.profiles)
+            results = map(_frames_job, jobs)
+            paths = [self._save(*res) for res in results]
+        else:
+            chunksize = max(1, len(jobs)//(self.workers*4))
+            with ProcessPoolExecutor(self.workers, initializer=_init_frames_worker, initargs=(self.profiles,)) as pool:
+                paths = [self._save(*res) for res in pool.map(_frames_job, jobs, chunksize=chunksize)]
+
+        elapsed = time.perf_counter()-t
+        self.stats = {
+            "clips": len(jobs),
+            "seconds": round(elapsed, 3),
+            "clips_per_sec": round(len(jobs)/elapsed, 2) if elapsed else 0.0,
+        }
+        logger.info(f"generated frames for {len(jobs)} clips at {self.stats['clips_per_sec']} clips/s")
+        return paths
+
+    def _save(self, frames_path: str, rows: list):
+        columnar.save_file(frames_path, rows, logger)
+        return frames_path
+
+
+def generate_frames_many(clips: list, **kwargs):
+    """
+    Shortcut for FramesBatch(**kwargs).run(clips).
+    """
+    return FramesBatch(**kwargs).run(clips)
+
+
 if __name__=="__main__":
     import os
     base_dir = "voice_files"  # Updated the correct path
@@ -0,0 +1,144 @@
+import os
+import time
+import threading
+
+import common as com
+
+logger = com.get_logger(__name__)
+
+EPITRAN_CODES = {
+    "hindi": "hin-Deva",
+    "arabic": "ara-Arab",
+    "telugu": "tel-Telu",
+    "tamil" : "tam-Taml",
+    "bengali": "ben-Beng",
+    "marathi": "mar-Deva"
+}
+
+_lock = threading.RLock()
+_resources = {}
+
+
+def _get(key, builder, *args):
+    res = _resources.get(key)
+    if res is None:
+        with _lock:
+            res = _resources.get(key)
+            if res is None:
+                t = time.perf_counter()
+                res = _resources[key] = builder(*args)
+                logger.info(f"loaded {key} in {time.perf_counter()-t:.2f}s")
+    return res
+
+
+def _build_g2p():
+    from g2p_en import G2p
+    return G2p()
+
+
+def _build_epitran(code: str):
+    import epitran
+    return epitran.Epitran(code)
+
+
+def get_g2p():
+    return _get("g2p", _build_g2p)
+
+
+def has_epitran(language: str):
+    return language in EPITRAN_CODES
+
+
+def get_epitran(language: str):
+    code = EPITRAN_CODES.get(language)
+    if not code:
+        com.RaiseError(NotImplementedError, f"Language {language} does not have an epitran model", logger)
+    return _get(f"epitran_{language}", _build_epitran, code)
+
+
+def get_epitran_models():
+    return {lang: get_epitran(lang) for lang in EPITRAN_CODES}
+
+
+def _build_uroman():
+    import uroman
+    return uroman.Uroman()
+
+
+def _build_tashkeel():
+    from mishkal.tashkeel import TashkeelClass
+    return TashkeelClass()
+
+
+def get_uroman():
+    return _get("uroman", _build_uroman)
+
+
+def get_tashkeel():
+    return _get("tashkeel", _build_tashkeel)
+
+
+def _build_arabic_frontend():
+    import arabic_frontend
+    return arabic_frontend.ArabicFrontEnd()
+
+
+def get_arabic_frontend():
+    return _get("arabic_frontend", _build_arabic_frontend)
+
+
+def ipa2arpa_path():
+    return str(com.hp.joinpath(com.MAPPINGS_DIR, "ipa_to_arpa.json"))
+
+
+def phoneme_ratios_path():
+    return str(com.hp.joinpath(com.ASSETS, "phoneme_ratios.json"))
+
+
+def get_ipa2arpa():
+    return _get("ipa2arpa", com.read_file, ipa2arpa_path(), logger)
+
+
+def get_phoneme_ratios():
+    return _get("phoneme_ratios", com.read_file, phoneme_ratios_path(), logger)
+
+
+def _build_phoneme_index():
+    import phoneme_index
+    json_path = phoneme_ratios_path()
+    index_path = os.path.splitext(json_path)[0] + ".idx"
+    if not os.path.isfile(index_path) or os.path.getmtime(index_path)<os.path.getmtime(json_path):
+        logger.warning(f"compiling {index_path}, run phoneme_index.py offline to keep this out of worker startup")
+        phoneme_index.compile_index(json_path, index_path)
+    return phoneme_index.PhonemeRatioIndex(index_path)
+
+
+def get_phoneme_index():
+    return _get("phoneme_index", _build_phoneme_index)
+
+
+def loaded():
+    return list(_resources)
+
+
+def preload(languages: list = None):
+    """
+    Builds the backends of `languages` (all known languages when None) up front,
+    for servers that would rather pay the load cost before the first request.
+    """
+    languages = languages or ["english", *EPITRAN_CODES]
+    get_ipa2arpa()
+    get_phoneme_index()
+    for lang in languages:
+        lang = lang.lower()
+        if lang=="english":
+            get_g2p()
+            continue
+        if lang=="arabic":
+            get_tashkeel()
+        elif has_epitran(lang):
+            get_epitran(lang)
+        else:
+            com.RaiseError(NotImplementedError, f"Language {lang} is not yet supported", logger)
+        # MMS_FA words of every other language are romanized
+        get_uroman()
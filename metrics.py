@@ -0,0 +1,231 @@
+import os
+import json
+import time
+import cProfile
+import itertools
+import threading
+import contextvars
+from collections import defaultdict, deque
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+
+import common as com
+
+logger = com.get_logger(__name__)
+
+ENABLED = os.environ.get("PIPELINE_METRICS", "1")!="0"
+# every PROFILE_EVERY-th request is run under cProfile and dumped to PROFILE_DIR/<request>-<pid>-<n>.prof
+PROFILE_DIR = os.environ.get("PIPELINE_PROFILE_DIR") or None
+PROFILE_EVERY = int(os.environ.get("PIPELINE_PROFILE_EVERY", 1))
+# per-request records are appended here as json lines when set
+RECORDS_LOG = os.environ.get("PIPELINE_METRICS_LOG") or None
+MAX_RECORDS = int(os.environ.get("PIPELINE_METRICS_RECORDS", 1000))
+
+_lock = threading.Lock()
+_spans = defaultdict(lambda: [0, 0.0, 0.0])
+_counters = defaultdict(int)
+_records = deque(maxlen=MAX_RECORDS)
+_request_ids = itertools.count()
+_current = contextvars.ContextVar("pipeline_request", default=None)
+_NULL = nullcontext()
+
+
+class Record:
+    """
+    Spans and counters of one request, for example one mfa_output or frames call.
+    """
+    __slots__ = ("name", "labels", "start", "seconds", "spans", "counters", "profile")
+
+    def __init__(self, name: str, labels: dict):
+        self.name = name
+        self.labels = labels
+        self.start = time.time()
+        self.seconds = None
+        self.spans = {}
+        self.counters = {}
+        self.profile = None
+
+    def to_dict(self):
+        return {
+            "request": self.name,
+            "labels": self.labels,
+            "start": self.start,
+            "seconds": round(self.seconds, 6) if self.seconds is not None else None,
+            "spans": {k: {"count": c, "seconds": round(s, 6)} for k, (c, s) in self.spans.items()},
+            "counters": dict(self.counters),
+            "profile": self.profile,
+        }
+
+
+class _Span:
+    __slots__ = ("name", "t")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.t = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        observe(self.name, time.perf_counter()-self.t)
+
+
+def span(name: str):
+    """
+    Context manager timing a pipeline phase. With metrics disabled it is a shared no-op.
+    """
+    return _Span(name) if ENABLED else _NULL
+
+
+def timed(name: str):
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return fn(*args, **kwargs)
+            with _Span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def observe(name: str, seconds: float):
+    with _lock:
+        s = _spans[name]
+        s[0] += 1
+        s[1] += seconds
+        if seconds>s[2]:
+            s[2] = seconds
+    rec = _current.get()
+    if rec is not None:
+        c, total = rec.spans.get(name, (0, 0.0))
+        rec.spans[name] = (c+1, total+seconds)
+
+
+def count(name: str, n: int = 1):
+    if not ENABLED:
+        return
+    with _lock:
+        _counters[name] += n
+    rec = _current.get()
+    if rec is not None:
+        rec.counters[name] = rec.counters.get(name, 0)+n
+
+
+def _start_profile(name: str, n: int):
+    if not PROFILE_DIR or n%PROFILE_EVERY:
+        return None
+    prof = cProfile.Profile()
+    try:
+        prof.enable()
+    except ValueError:
+        # another profiler is already active in this process
+        return None
+    return prof
+
+
+@contextmanager
+def request(name: str, **labels):
+    """
+    Collects the spans and counters of everything run inside it into one record. Nested requests
+    are timed as spans of the outer one. Spans run in other threads or processes are only part of
+    the aggregate.
+    """
+    if _current.get() is not None or not (ENABLED or PROFILE_DIR):
+        with span(name):
+            yield _current.get()
+        return
+
+    rec = Record(name, labels)
+    token = _current.set(rec)
+    n = next(_request_ids)
+    prof = _start_profile(name, n)
+    t = time.perf_counter()
+    try:
+        yield rec
+    finally:
+        rec.seconds = time.perf_counter()-t
+        if prof is not None:
+            prof.disable()
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            rec.profile = os.path.join(PROFILE_DIR, f"{name}-{os.getpid()}-{n}.prof")
+            prof.dump_stats(rec.profile)
+        _current.reset(token)
+        if ENABLED:
+            observe(name, rec.seconds)
+            _add_record(rec.to_dict())
+
+
+def _add_record(rec: dict):
+    with _lock:
+        _records.append(rec)
+        if RECORDS_LOG:
+            with open(RECORDS_LOG, "a", encoding="utf-8") as f:
+                f.write(json.dumps(rec)+"\n")
+
+
+def records():
+    with _lock:
+        return list(_records)
+
+
+def snapshot():
+    """
+    Aggregate spans and counters of this process since the last reset.
+    """
+    with _lock:
+        return {
+            "pid": os.getpid(),
+            "spans": {k: {"count": c, "seconds": round(s, 6), "max": round(m, 6)} for k, (c, s, m) in _spans.items()},
+            "counters": dict(_counters),
+        }
+
+
+def prometheus():
+    """
+    snapshot() in the Prometheus text exposition format.
+    """
+    snap = snapshot()
+    lines = ["# TYPE pipeline_span_seconds summary"]
+    for k, v in sorted(snap["spans"].items()):
+        lines.append(f'pipeline_span_seconds_count{{span="{k}"}} {v["count"]}')
+        lines.append(f'pipeline_span_seconds_sum{{span="{k}"}} {v["seconds"]}')
+    lines.append("# TYPE pipeline_span_seconds_max gauge")
+    for k, v in sorted(snap["spans"].items()):
+        lines.append(f'pipeline_span_seconds_max{{span="{k}"}} {v["max"]}')
+    lines.append("# TYPE pipeline_events_total counter")
+    for k, v in sorted(snap["counters"].items()):
+        lines.append(f'pipeline_events_total{{name="{k}"}} {v}')
+    return "\n".join(lines)+"\n"
+
+
+def dump(path: str):
+    """
+    Writes the aggregate as Prometheus text for .prom/.txt paths and as json otherwise.
+    """
+    if os.path.splitext(path)[1].lower() in (".prom", ".txt"):
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(prometheus())
+    else:
+        com.save_file(path, {**snapshot(), "records": records()}, logger)
+    return path
+
+
+def reset():
+    with _lock:
+        _spans.clear()
+        _counters.clear()
+        _records.clear()
+
+
+def configure(enabled: bool = None, profile_dir: str = None, profile_every: int = None, records_log: str = None):
+    global ENABLED, PROFILE_DIR, PROFILE_EVERY, RECORDS_LOG
+    if enabled is not None:
+        ENABLED = enabled
+    if profile_dir is not None:
+        PROFILE_DIR = profile_dir or None
+    if profile_every is not None:
+        PROFILE_EVERY = max(1, profile_every)
+    if records_log is not None:
+        RECORDS_LOG = records_log or None
@@ -0,0 +1,132 @@
+import os
+import copy
+import threading
+from queue import Queue, Empty
+from contextlib import contextmanager
+
+import torch
+from torchaudio.pipelines import MMS_FA as bundle
+
+import common as com
+import metrics
+
+logger = com.get_logger(__name__)
+
+DEFAULT_POOL_SIZE = int(os.environ.get("MMS_FA_POOL_SIZE", 1))
+SAMPLE_RATE = bundle.sample_rate
+
+_lock = threading.Lock()
+_tokenizer = None
+_aligner = None
+_pools = {}
+
+
+def default_device():
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
+
+def get_tokenizer():
+    global _tokenizer
+    if _tokenizer is None:
+        with _lock:
+            if _tokenizer is None:
+                with metrics.span("model_load"):
+                    _tokenizer = bundle.get_tokenizer()
+    return _tokenizer
+
+
+def get_aligner():
+    global _aligner
+    if _aligner is None:
+        with _lock:
+            if _aligner is None:
+                with metrics.span("model_load"):
+                    _aligner = bundle.get_aligner()
+    return _aligner
+
+
+class ModelPool:
+    """
+    Pool of warm MMS_FA emission models for one device. Replicas are built
+    lazily up to `size`, so a single-threaded worker only ever holds one.
+    """
+    def __init__(self, device: str, size: int = DEFAULT_POOL_SIZE):
+        self.device = device
+        self.size = max(1, size)
+        self._idle = Queue()
+        self._base = None
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _build(self):
+        if self._base is None:
+            logger.info(f"loading MMS_FA model on {self.device}")
+            with metrics.span("model_load"):
+                self._base = bundle.get_model().to(self.device).eval()
+            return self._base
+        # Copying the already loaded weights is much cheaper than going through the bundle again
+        with metrics.span("model_replica"):
+            return copy.deepcopy(self._base)
+
+    def _get(self, timeout: float = None):
+        try:
+            return self._idle.get_nowait()
+        except Empty:
+            pass
+
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                try:
+                    return self._build()
+                except Exception:
+                    self._created -= 1
+                    raise
+        try:
+            return self._idle.get(timeout=timeout)
+        except Empty:
+            com.RaiseError(TimeoutError, f"no MMS_FA model became free on {self.device} within {timeout}s", logger)
+
+    @contextmanager
+    def acquire(self, timeout: float = None):
+        model = self._get(timeout)
+        try:
+            yield model
+        finally:
+            self._idle.put(model)
+
+    def warmup(self):
+        models = [self._get() for _ in range(self.size)]
+        for model in models:
+            self._idle.put(model)
+
+    @property
+    def loaded(self):
+        return self._created
+
+
+def get_pool(device: str = None, size: int = None):
+    device = str(torch.device(device or default_device()))
+    with _lock:
+        pool = _pools.get(device)
+        if pool is None:
+            pool = _pools[device] = ModelPool(device, size or DEFAULT_POOL_SIZE)
+        elif size and size > pool.size:
+            pool.size = size
+    return pool
+
+
+def warmup(device: str = None, size: int = None):
+    get_tokenizer()
+    get_aligner()
+    pool = get_pool(device, size)
+    pool.warmup()
+    return pool
+
+
+def clear():
+    global _tokenizer, _aligner
+    with _lock:
+        _pools.clear()
+        _tokenizer = None
+        _aligner = None
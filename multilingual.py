@@ -1,11 +1,13 @@
 import os
+import bisect
 import string
-import epitran
+from collections import deque
 
-from g2p_en import G2p
 from ipatok import tokenise
 
 from pathlib import PosixPath
+from concurrent.futures import ProcessPoolExecutor
+from _kalpy.matrix import DoubleMatrix, FloatMatrix
 from kalpy.utterance import Segment
 from kalpy.feat.cmvn import CmvnComputer
 from kalpy.fstext.lexicon import HierarchicalCtm
@@ -16,61 +18,126 @@ from montreal_forced_aligner.corpus.classes import FileData
 from montreal_forced_aligner.online.alignment import align_utterance_online
 import os
 import json
-import librosa
 import torchaudio
 import torch
-from torchaudio.pipelines import MMS_FA as bundle
 
 import common as com
+import metrics
+import mms_models
+import audio_io
+import columnar
+import language_resources as lr
+import oov_cache
+from text_normalizer import normalize_uroman
+import alignment_cache
 from aligners import get_aligners 
-import uroman
-from mishkal.tashkeel import TashkeelClass 
-import re
 
 logger = com.get_logger(__name__)
-ipa2arpa = com.read_file(com.hp.joinpath(com.MAPPINGS_DIR, "ipa_to_arpa.json"), logger)
-phoneme_ratios: dict = com.read_file(com.hp.joinpath(com.ASSETS, "phoneme_ratios.json"), logger)
-
-g2p = G2p()
-epitran_models = {
-    "hindi": epitran.Epitran("hin-Deva"),
-    "arabic": epitran.Epitran("ara-Arab"),
-    "telugu": epitran.Epitran("tel-Telu"),
-    "tamil" : epitran.Epitran("tam-Taml"),
-    "bengali": epitran.Epitran("ben-Beng"),
-    "marathi": epitran.Epitran("mar-Deva")
+preload = lr.preload
+
+# The language backends and mapping tables are built on first use by language_resources,
+# these names stay importable from here for older callers.
+_LAZY_RESOURCES = {
+    "g2p": lr.get_g2p,
+    "epitran_models": lr.get_epitran_models,
+    "ipa2arpa": lr.get_ipa2arpa,
+    "phoneme_ratios": lr.get_phoneme_ratios,
 }
 
 
+def __getattr__(name):
+    if name in _LAZY_RESOURCES:
+        return _LAZY_RESOURCES[name]()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
 MFA_WORD_REPLACE_MAP = {
     "<eps>": " "
 }
 MFA_PHONEME_REPLACE_MAP = {
     "sil": " "
 }
+PHONE_POSITION_SUFFIXES = ("_B", "_E", "_I", "_S")
+ALIGN_OPTIONS = [
+    "beam",
+    "retry_beam",
+    "acoustic_scale",
+    "transition_scale",
+    "self_loop_scale",
+    "boost_silence",
+]
+
+
+def join_word_phones(words: list, phones: list, oov, convert):
+    """
+    Rebuilds the phone tier word by word from the MFA word and phone tiers. A phone is kept
+    for every word whose interval contains it, and an 'spn' phone spanning the whole word is
+    replaced by oov(start, end, word). `phones` must be sorted by start time as MFA writes them;
+    each word bisects to its first candidate phone, so the join is linear in the output size.
+    """
+    stripped = []
+    for sta, end, p in phones:
+        if len(p)>2 and p[-2:] in PHONE_POSITION_SUFFIXES:
+            p = p[:-2]
+        stripped.append((sta, end, p))
+    starts = [sta for sta, _, _ in stripped]
+
+    out = []
+    for w_sta, w_end, w in words:
+        for k in range(bisect.bisect_left(starts, w_sta), len(stripped)):
+            p_sta, p_end, p = stripped[k]
+            if p_sta>w_end:
+                break
+            if p_end>w_end:
+                continue
+            if w_sta==p_sta and w_end==p_end and p.startswith("spn"):
+                out.extend(oov(p_sta, p_end, w))
+                break
+            if p.strip():
+                p = convert(p)
+            out.append([p_sta, p_end, p.upper()])
+    return out
 
 
-# Normalization function
-def normalize_uroman(text):
-    text = text.lower()
-    text = text.replace("’", "'")
-    text = re.sub("([^a-z' ])", " ", text)
-    text = re.sub(' +', ' ', text)
-    return text.strip()
+def align_emission(emission, words: list):
+    """
+    CTC forced alignment of one utterance's (frames, tokens) emission against its romanized words.
+    """
+    tokenizer = mms_models.get_tokenizer()
+    aligner = mms_models.get_aligner()
+    with metrics.span("ctc_align"):
+        return aligner(emission, tokenizer(words))
 
 class Mfa_output:
     def __init__(self, utterance_path : str, voice_path : str, **kwargs) -> None:
+        """
+        Both paths may be None for an instance that only aligns transcripts and waveforms
+        held in memory through align_words, as the alignment service does.
+        """
         self.utterance_path = utterance_path
-        self.ur = uroman.Uroman()
         self.voice_path = voice_path
-        self.output_dir = com.hp.dirname(self.utterance_path)
-        if not os.path.isfile(self.utterance_path) or not os.path.isfile(self.voice_path):
-            com.RaiseError(FileNotFoundError, f"output_dir {self.output_dir} does not have either voice.wav and/or utterance.txt files", logger)
-        
-        self.aligner_output_path = self.output_dir + "/mfa_output.json"
+        output_format = kwargs.get("output_format", "json")
+        if output_format not in ("json", "npz"):
+            com.RaiseError(ValueError, f"output_format must be either 'json' or 'npz', got '{output_format}'", logger)
+
+        if utterance_path is None and voice_path is None:
+            self.output_dir = self.aligner_output_path = self.original_output_path = None
+        else:
+            self.output_dir = com.hp.dirname(self.utterance_path)
+            if not os.path.isfile(self.utterance_path) or not os.path.isfile(self.voice_path):
+                com.RaiseError(FileNotFoundError, f"output_dir {self.output_dir} does not have either voice.wav and/or utterance.txt files", logger)
+            self.aligner_output_path = self.output_dir + f"/mfa_output.{output_format}"
+            self.original_output_path = self.output_dir + "/original_mfa_output.json"
         self.lang = kwargs.get("language", "english").lower()
         self.language = kwargs.get("language", "english")
         self.kwargs: dict = kwargs.get("phoneme_params", {})
+        self.device = kwargs.get("device") or mms_models.default_device()
+        self.oov_cache = kwargs.get("oov_cache") or oov_cache.get_cache()
+        # alignment_cache=False always runs the aligner, None uses alignment_cache.get_cache() when mfa_output runs
+        self.alignment_cache = kwargs.get("alignment_cache")
+        self.workers = kwargs.get("workers") or os.cpu_count() or 1
+        # Arabic transcripts waiting to be diacritized, bounded for instances shared by a service
+        self._arabic_texts = deque(maxlen=64)
 
         insts = get_aligners(list_=False)
         self.aligner_instance = insts.get(self.language)
@@ -108,7 +175,7 @@ class Mfa_output:
     def convert_ipa_arpa(self, p: str):
         arpa = self._check_is_arpa(p)
         if not arpa:
-            pi = ipa2arpa.get(p)
+            pi = lr.get_ipa2arpa().get(p)
             if pi:
                 p = pi
             else:
@@ -123,25 +190,22 @@ class Mfa_output:
         return p
 
 
-    def _oov(self, w_sta, w_end, word, lang: str=None):
-        logger.info(f"found {word} which is not in vocabulary")
-        t = w_end-w_sta
-        lang = lang or self.lang
+    def _word_phones(self, word: str, lang: str):
+        """
+        ARPA phones of a word with their duration ratio weights, as [phone, ratio] pairs.
+        """
         if lang=="english":
-            ph = g2p(word)
-        elif lang in epitran_models:
-            epi = epitran_models[lang]
+            ph = lr.get_g2p()(word)
+        elif lang=="arabic":
+            ph = self._arabic_phones(word)
+        elif lr.has_epitran(lang):
+            epi = lr.get_epitran(lang)
             ph = epi.transliterate(word)
             ph = tokenise(ph)
-        #handling the arabic case
-        elif lang == "arabic":
-            diacritized_text = vocalizer.tashkeel(word)
-            romanized_text = self.ur.romanize_string(diacritized_text)
-            normalized_arabic_text = normalize_uroman(romanized_arabic_text)
-            ph = tokenise(normalized_arabic_text)           
         else:
             com.RaiseError(NotImplementedError, f"Language {lang} is not yet supported", logger)
-        
+
+        ratios = lr.get_phoneme_index()
         new_ph = {}
         ph_len = len(ph)
         for i, p in enumerate(ph):
@@ -156,19 +220,20 @@ class Mfa_output:
             else:
                 nxt = "-"
             
-            ratio = phoneme_ratios.get(self._assign_phoneme_suffix(p, i, ph_len), {}).get(prev, {}).get(nxt)
-            if not ratio:
-                ratio = 0.3
-                for vow in ["A", "E", "I", "O", "U"]:
-                    if p.startswith(vow):
-                        ratio = 0.5
-                        break
-            new_ph[p] = ratio
-        
+            new_ph[p] = ratios.ratio(self._assign_phoneme_suffix(p, i, ph_len), prev, nxt, phone=p)
+        return list(new_ph.items())
+
+    def _oov(self, w_sta, w_end, word, lang: str=None):
+        logger.info(f"found {word} which is not in vocabulary")
+        t = w_end-w_sta
+        lang = lang or self.lang
+        metrics.count("oov_words")
+        new_ph = self.oov_cache.get_or_compute(lang, word, lambda: self._oov_g2p(word, lang))
+
         phones = []
-        tw = sum(new_ph.values())
+        tw = sum(w for _, w in new_ph)
         p_sta = w_sta
-        for i, (p, w) in enumerate(new_ph.items()):
+        for i, (p, w) in enumerate(new_ph):
             if i==len(new_ph)-1:
                 p_end = w_end
             else:
@@ -178,97 +243,295 @@ class Mfa_output:
         logger.info(f"generated the phonemes and timestamps for the word {word}")
         return phones
     
-    def _get_word_timestamps(self):
-        waveform, sample_rate = librosa.load(self.voice_path, sr=None)
-        transcript = com.read_file(self.utterance_path, logger)
-        token_spans, num_frames = self.get_token_spans_pytorch(waveform, transcript)
-        ratio = waveform.size(1) / num_frames
-        phones = []
-        word_timestamps = []
+    def _oov_g2p(self, word: str, lang: str):
+        with metrics.span("oov_g2p"):
+            return self._word_phones(word, lang)
+
+    def _spn_phones(self, p_sta, p_end, word):
+        out = self._oov(p_sta, p_end, word)
+        if not out:
+            logger.warning("attempting to use english language as a backup")
+            out = self._oov(p_sta, p_end, word, lang="english")
+            #TODO: use epitran backoff to handle different languages
+        return out or [[p_sta, p_end, " "]]
+
+    def _load_waveform(self):
+        waveform, _ = audio_io.load(self.voice_path, sr=mms_models.SAMPLE_RATE)
+        return torch.from_numpy(waveform)
+
+    def _read_words(self):
+        return self._split_words(com.read_file(self.utterance_path, logger))
 
-        for t_spans, word in zip(token_spans, transcript):
-            start_time = t_spans[0].start * ratio / self.sample_rate
-            end_time = t_spans[-1].end * ratio / self.sample_rate
-            word_timestamps.append({"word": word, "start": start_time, "end": end_time})
+    def _prepare_text(self, transcript: str):
+        # Arabic words are diacritized in the context of their whole utterance once _oov needs one of them
+        if self.lang=="arabic":
+            self._arabic_texts.append(transcript)
 
-            # Call the _oov function to get the phonemes and their timestamps
-            ph = self._oov(start_time, end_time, word, lang=self.lang)
-            phones.extend(ph)  # Add phonemes to the phones list
+    def _arabic_phones(self, word: str):
+        frontend = lr.get_arabic_frontend()
+        while self._arabic_texts:
+            try:
+                text = self._arabic_texts.popleft()
+            except IndexError:
+                break
+            frontend.prepare(text)
+        return frontend.word_phones(word)
 
-        result = {
+    def _split_words(self, transcript: str):
+        """
+        Returns the transcript words together with the romanized form the MMS_FA tokenizer accepts.
+        Words without any alignable characters (punctuation only) are dropped.
+        """
+        self._prepare_text(transcript)
+        words, mms_words = [], []
+        ur = lr.get_uroman() if self.lang!="english" else None
+        for w in transcript.split():
+            mw = w if ur is None else ur.romanize_string(w)
+            mw = normalize_uroman(mw).replace(" ", "")
+            if mw:
+                words.append(w)
+                mms_words.append(mw)
+        return words, mms_words
+
+    def _spans_to_result(self, token_spans, words: list, num_frames: int, num_samples: int):
+        ratio = num_samples / num_frames
+        sr = mms_models.SAMPLE_RATE
+        word_timestamps = []
+        phones = []
+        for t_spans, word in zip(token_spans, words):
+            start_time = round(t_spans[0].start * ratio / sr, 2)
+            end_time = round(t_spans[-1].end * ratio / sr, 2)
+            word_timestamps.append([start_time, end_time, word])
+            phones.extend(self._oov(start_time, end_time, word, lang=self.lang))
+
+        return {
             "start": 0,
-            "end": librosa.get_duration(waveform.numpy(), sr=self.sample_rate),
-            "words": word_timestamps,  # List of word timestamps
-            "phones": phones  # List of phoneme timestamps
+            "end": round(num_samples / sr, 2),
+            "words": word_timestamps,
+            "phones": phones
         }
-        
-        return result
-     
+
+    def align_words(self, emission, transcript: str, num_samples: int):
+        """
+        Word and phone timestamps, in the mfa_output.json layout, of a transcript given the
+        (frames, tokens) emission of its num_samples long waveform.
+        """
+        words, mms_words = self._split_words(transcript)
+        token_spans = align_emission(emission, mms_words)
+        return self._spans_to_result(token_spans, words, emission.size(0), num_samples)
+
+    def _get_word_timestamps(self):
+        waveform = self._load_waveform()
+        words, mms_words = self._read_words()
+        token_spans, num_frames = self.get_token_spans_pytorch(waveform.unsqueeze(0), mms_words)
+        return self._spans_to_result(token_spans, words, num_frames, waveform.size(0))
+
+    def stream_word_timestamps(self, window: float=30, overlap: float=5, max_chars_per_sec: float=25):
+        """
+        Aligns the utterance window by window and yields {"word", "start", "end", "phones"} for every
+        word as soon as its window finalizes it, so memory stays bounded by the window size.
+        Each window is aligned against the next words that could fit in it followed by the MMS_FA '*'
+        wildcard, which absorbs the speech of words that did not. Only words ending before the last
+        `overlap` seconds of a window are kept, the next window starts where the last kept word ended.
+        """
+        sr = mms_models.SAMPLE_RATE
+        words, mms_words = self._read_words()
+        duration = audio_io.get_duration(self.voice_path)
+        pool = mms_models.get_pool(self.device)
+        start = 0.0
+        k = 0
+        win = window
+        while k<len(words):
+            final = start+win>=duration
+            waveform, _ = audio_io.load_window(self.voice_path, start, None if final else win, sr=sr)
+            waveform = torch.from_numpy(waveform)
+            with pool.acquire() as model, torch.inference_mode():
+                emission, _ = model(waveform.unsqueeze(0).to(self.device))
+            emission = emission[0].cpu()
+            sec_per_frame = waveform.size(0)/emission.size(0)/sr
+
+            if final:
+                n = len(words)-k
+                token_spans = align_emission(emission, mms_words[k:])
+            else:
+                n, chars = 0, 0
+                while k+n<len(words) and chars<=win*max_chars_per_sec:
+                    chars += len(mms_words[k+n])
+                    n += 1
+                token_spans = align_emission(emission, mms_words[k:k+n]+["*"])[:n]
+
+            committed = 0
+            for t_spans, word in zip(token_spans, words[k:k+n]):
+                w_sta = round(start+t_spans[0].start*sec_per_frame, 2)
+                w_end = round(start+t_spans[-1].end*sec_per_frame, 2)
+                if not final and w_end-start>win-overlap:
+                    break
+                yield {"word": word, "start": w_sta, "end": w_end, "phones": self._oov(w_sta, w_end, word, lang=self.lang)}
+                committed += 1
+                last_end = w_end
+
+            if committed:
+                k += committed
+                start = last_end
+                win = window
+            elif token_spans and token_spans[0][0].start>0:
+                # nothing but silence before the first word
+                start = round(start+token_spans[0][0].start*sec_per_frame, 2)
+            else:
+                # the next word does not fit, retry with a larger window
+                win *= 2
+
+    def stream_phoneme_rows(self, **kwargs):
+        """
+        Rows of [phone_start, phone_end, phone, word, word_start, word_end] from stream_word_timestamps,
+        in the layout Frames reads from phonemes.csv.
+        """
+        for w in self.stream_word_timestamps(**kwargs):
+            for p_sta, p_end, p in w["phones"]:
+                yield [p_sta, p_end, p, w["word"], w["start"], w["end"]]
+
+    def _emission(self, waveform):
+        # (1, frames, tokens) emission of a (1, samples) waveform
+        with mms_models.get_pool(self.device).acquire() as model, torch.inference_mode(), metrics.span("emission"):
+            emission, _ = model(waveform.to(self.device))
+        return emission
+
     def get_token_spans_pytorch(self, waveform, transcript):
-        model = bundle.get_model().to(self.device)
-        tokenizer = bundle.get_tokenizer()
-        aligner = bundle.get_aligner()
-        
-        with torch.inference_mode():
-            emission, = model(waveform.to(self.device))
-            token_spans = aligner(emission[0], tokenizer(transcript))
-        
+        emission = self._emission(waveform)
+        token_spans = align_emission(emission[0], transcript)
         num_frames = emission.size(1)
         return token_spans, num_frames
         
     
-    def mfa_output(self):
+    def _align_serial(self, segments: list, align_options: dict):
+        cmvn_computer = CmvnComputer()
+        utterances = []
+        with metrics.span("mfcc"):
+            for voice_path, begin, end, channel, text in segments:
+                seg = Segment(voice_path, begin, end, channel)
+                utt = KalpyUtterance(seg, text)
+                utt.generate_mfccs(self.acoustic_model.mfcc_computer)
+                utterances.append(utt)
+        with metrics.span("cmvn"):
+            cmvn = cmvn_computer.compute_cmvn_from_features([utt.mfccs for utt in utterances])
+
+        word_intervals = []
+        for utt in utterances:
+            with metrics.span("cmvn"):
+                utt.apply_cmvn(cmvn)
+            with metrics.span("align_utterance_online"):
+                ctm = align_utterance_online(
+                    self.acoustic_model,
+                    utt,
+                    self.lexicon_compiler,
+                    tokenizer=self.tokenizer,
+                    #g2p_model=g2p_model,
+                    **align_options,
+                )
+            word_intervals.extend(ctm.word_intervals)
+        return word_intervals
+
+    def _align_parallel(self, segments: list, align_options: dict):
+        """
+        Generates the MFCCs and aligns the segments in the worker processes. CMVN is still
+        computed here over every segment, and pool.map keeps the segments in their original order.
+        """
+        pool = get_align_pool(self.language, self.workers)
+        # wall time of the pool stages, the worker processes keep their own metrics
+        with metrics.span("mfcc"):
+            mfccs = list(pool.map(_worker_mfccs, segments))
+        with metrics.span("cmvn"):
+            cmvn = CmvnComputer().compute_cmvn_from_features([FloatMatrix(m) for m in mfccs]).numpy()
+
+        word_intervals = []
+        with metrics.span("align_utterance_online"):
+            for intervals in pool.map(_worker_align, [(seg, m, cmvn, align_options) for seg, m in zip(segments, mfccs)]):
+                word_intervals.extend(intervals)
+        return word_intervals
+
+    def _lexicon_version(self):
+        # the dictionary file when the aligner exposes it, else the word table of the compiled lexicon
+        path = getattr(self.aligner_instance, "dictionary_path", None) or self.inst_conf.get("dictionary_path")
+        if path and os.path.isfile(path):
+            return alignment_cache._file_digest(path)
+        word_table = getattr(self.lexicon_compiler, "word_table", None)
+        if word_table is not None and hasattr(word_table, "checksum"):
+            return str(word_table.checksum())
+        return None
+
+    def _model_version(self):
+        """
+        Version of everything mfa_output depends on besides its inputs: the acoustic model, the
+        lexicon, and the ipa_to_arpa.json and phoneme_ratios.json mappings of the phone tier.
+        """
+        meta = getattr(self.acoustic_model, "meta", None) or {}
+        mappings = [alignment_cache._file_digest(p) if os.path.isfile(p) else None
+                    for p in (lr.ipa2arpa_path(), lr.phoneme_ratios_path())]
+        return ":".join(map(str, [getattr(self.acoustic_model, "name", self.language), meta.get("version"),
+                                  self._lexicon_version(), *mappings]))
+
+    def mfa_output(self, save: bool=True):
+        """
+        Aligns the utterance with MFA and writes mfa_output.json (or .npz) with the word tier and the
+        rebuilt phone tier. With save=False the output dict is returned instead of being written.
+        Results are looked up in the alignment cache by content first; a hit skips feature extraction
+        and alignment, and original_mfa_output.json is written from the cached MFA export.
+        """
+        self.inst_conf.update(self.kwargs)
+        align_options = {k: v for k, v in self.inst_conf.items() if k in ALIGN_OPTIONS}
+        cache = alignment_cache.get_cache() if self.alignment_cache is None else self.alignment_cache
+        with metrics.request("mfa_output", voice_path=str(self.voice_path), language=self.language):
+            if cache:
+                with open(self.utterance_path, encoding="utf-8") as f:
+                    transcript = f.read()
+                key = alignment_cache.cache_key(self.voice_path, transcript, self.language, align_options, self._model_version())
+                entry = cache.get(key)
+                if entry is None:
+                    original = self._align_file(align_options)
+                    entry = cache.put(key, {"original": original, "mfa_output": self._tiers_to_output(dict(original))})
+                else:
+                    com.save_file(self.original_output_path, entry["original"], logger)
+                nd = entry["mfa_output"]
+            else:
+                nd = self._tiers_to_output(self._align_file(align_options))
+            if not save:
+                return nd
+            with metrics.span("save"):
+                if com.hp.isfile(self.aligner_output_path):
+                    com.os.remove(self.aligner_output_path)
+                columnar.save_file(self.aligner_output_path, nd, logger)
+        return self.aligner_output_path
+
+    def _align_file(self, align_options: dict):
+        """
+        Runs MFA over the utterance and returns its textgrid json export, also written to original_mfa_output.json.
+        """
         voice_path = PosixPath(self.voice_path)
         utterance_path = PosixPath(self.utterance_path)
-        if com.hp.isfile(self.aligner_output_path):
-            com.os.remove(self.aligner_output_path)
-
-        alignment_file = PosixPath(self.aligner_output_path)
+        alignment_file = PosixPath(self.original_output_path)
         file_name = voice_path.stem
         file = FileData.parse_file(file_name, voice_path, utterance_path, "", 0)
         file_ctm = HierarchicalCtm([])
-        cmvn_computer = CmvnComputer()
 
-        utterances = []
-        for utterance in file.utterances:
-            seg = Segment(voice_path, utterance.begin, utterance.end, utterance.channel)
-            utt = KalpyUtterance(seg, utterance.text)
-            utt.generate_mfccs(self.acoustic_model.mfcc_computer)
-            utterances.append(utt)
-        cmvn = cmvn_computer.compute_cmvn_from_features([utt.mfccs for utt in utterances])
-        self.inst_conf.update(self.kwargs)
-
-        align_options = {
-            k: v
-            for k, v in self.inst_conf.items()
-            if k
-            in [
-                "beam",
-                "retry_beam",
-                "acoustic_scale",
-                "transition_scale",
-                "self_loop_scale",
-                "boost_silence",
-            ]
-        }
-        for utt in utterances:
-            utt.apply_cmvn(cmvn)
-            ctm = align_utterance_online(
-                self.acoustic_model,
-                utt,
-                self.lexicon_compiler,
-                tokenizer=self.tokenizer,
-                #g2p_model=g2p_model,
-                **align_options,
-            )
-            file_ctm.word_intervals.extend(ctm.word_intervals)
+        segments = [(voice_path, u.begin, u.end, u.channel, u.text) for u in file.utterances]
+        for u in file.utterances:
+            self._prepare_text(u.text)
+        if self.workers>1 and len(segments)>1:
+            word_intervals = self._align_parallel(segments, align_options)
+        else:
+            word_intervals = self._align_serial(segments, align_options)
+        file_ctm.word_intervals.extend(word_intervals)
 
         file_ctm.export_textgrid(
             alignment_file, file_duration=file.wav_info.duration, output_format="json"
         )
-        dict_ = com.read_file(self.aligner_output_path, logger)
-        com.save_file(self.aligner_output_path.replace("mfa", "original_mfa"), dict_, logger)
+        return com.read_file(self.original_output_path, logger)
 
+    def _tiers_to_output(self, dict_: dict):
+        """
+        mfa_output dict of an MFA textgrid json export: word tier with '<eps>' blanked and the phone
+        tier rebuilt word by word, out of vocabulary words getting generated phones.
+        """
         nd = {}
         for k, v in dict_.copy().items():
             if k=="tiers":
@@ -284,31 +547,126 @@ class Mfa_output:
                     np.append([sta, end, p])
                 
                 nd["words"] = nw
-                nd["phones"] = []
-                
-                for w_sta, w_end, w in nw:
-                    for p_sta, p_end, p in np:
-                        if len(p)>2 and p[-2:] in ["_B", "_E", "_I", "_S"]:
-                            p = p[:-2]
-                        
-                        if p_sta<w_sta or p_end>w_end:
-                            continue
-                        elif w_sta==p_sta and w_end==p_end and p.startswith("spn"):
-                            out = self._oov(p_sta, p_end, w)
-                            if not out:
-                                logger.warning("attempting to use english language as a backup")
-                                out = self._oov(p_sta, p_end, w, lang="english")
-                                #TODO: use epitran backoff to handle different languages
-                            if out:
-                                nd["phones"].extend(out)
-                            else:
-                                nd["phones"].append([p_sta, p_end, " "])
-                            break
-                        else:
-                            if p.strip():
-                                p = self.convert_ipa_arpa(p)
-                            nd["phones"].append([p_sta, p_end, p.upper()])
+                with metrics.span("word_phone_join"):
+                    nd["phones"] = join_word_phones(nw, np, self._spn_phones, self.convert_ipa_arpa)
             else:
                 nd[k] = v
-        com.save_file(self.aligner_output_path, nd, logger)
-        return self.aligner_output_path
\ No newline at end of file
+        return nd
+
+
+_align_worker = None
+_align_pools = {}
+
+
+def _init_align_worker(language: str):
+    # loads the acoustic model and lexicon compiler once per worker process
+    global _align_worker
+    _align_worker = get_aligners(list_=False)[language]
+
+
+def _worker_mfccs(segment: tuple):
+    voice_path, begin, end, channel, text = segment
+    utt = KalpyUtterance(Segment(voice_path, begin, end, channel), text)
+    utt.generate_mfccs(_align_worker.acoustic_model.mfcc_computer)
+    return utt.mfccs.numpy()
+
+
+def _worker_align(job: tuple):
+    (voice_path, begin, end, channel, text), mfccs, cmvn, align_options = job
+    utt = KalpyUtterance(Segment(voice_path, begin, end, channel), text)
+    utt.mfccs = FloatMatrix(mfccs)
+    utt.apply_cmvn(DoubleMatrix(cmvn))
+    ctm = align_utterance_online(
+        _align_worker.acoustic_model,
+        utt,
+        _align_worker.lexicon_compiler,
+        tokenizer=_align_worker.tokenizer,
+        **align_options,
+    )
+    return ctm.word_intervals
+
+
+def get_align_pool(language: str, workers: int=None):
+    """
+    Process pool of MFA aligners for `language`, kept alive between requests.
+    """
+    workers = workers or os.cpu_count() or 1
+    pool = _align_pools.get((language, workers))
+    if pool is None:
+        logger.info(f"starting {workers} alignment workers for {language}")
+        pool = _align_pools[(language, workers)] = ProcessPoolExecutor(workers, initializer=_init_align_worker, initargs=(language,))
+    return pool
+
+
+def _length_buckets(lengths: list, batch_size: int, max_batch_samples: int):
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+    buckets = []
+    bucket = []
+    for i in order:
+        # lengths are ascending, so the current item decides the padded size of the bucket
+        if bucket and (len(bucket)==batch_size or (len(bucket)+1)*lengths[i]>max_batch_samples):
+            buckets.append(bucket)
+            bucket = []
+        bucket.append(i)
+    if bucket:
+        buckets.append(bucket)
+    return buckets
+
+
+def batch_emissions(waveforms: list, device: str=None):
+    """
+    One padded MMS_FA forward pass over 1-D waveforms, returning each waveform's (frames, tokens) emission,
+    the same as running the model on the waveform alone. The bundle's model wrapper normalizes its whole
+    input tensor and appends the star column for a batch of one, so its steps are done here per waveform:
+    each waveform is normalized over its own samples before padding, the inner Wav2Vec2Model runs with
+    the lengths, and the log softmax and star column are applied to every emission.
+    """
+    device = device or mms_models.default_device()
+    lengths = torch.tensor([w.size(0) for w in waveforms])
+    with mms_models.get_pool(device).acquire() as model, torch.inference_mode(), metrics.span("emission"):
+        inner = getattr(model, "model", model)
+        if getattr(model, "normalize_waveform", False):
+            waveforms = [torch.nn.functional.layer_norm(w, w.shape) for w in waveforms]
+        batch = torch.nn.utils.rnn.pad_sequence(list(waveforms), batch_first=True)
+        emissions, emission_lengths = inner(batch.to(device), lengths.to(device))
+        emissions = emissions.cpu()
+        out = []
+        for j, n in enumerate(emission_lengths):
+            emission = emissions[j, :int(n)]
+            if getattr(model, "apply_log_softmax", False):
+                emission = torch.nn.functional.log_softmax(emission, dim=-1)
+            if getattr(model, "append_star", False):
+                emission = torch.cat((emission, emission.new_zeros(emission.size(0), 1)), dim=-1)
+            out.append(emission)
+    return out
+
+
+def align_batch(pairs: list, language: str="english", device: str=None, batch_size: int=8, max_batch_seconds: float=240, **kwargs):
+    """
+    Aligns many (voice_path, utterance_path) pairs with the MMS_FA model.
+    Clips are length sorted into padded buckets by the durations in their headers, so each bucket
+    takes a single forward pass and only one bucket's audio is decoded at a time, then every
+    utterance gets its own mfa_output.json next to its utterance.txt.
+    Returns the written output paths in the order of `pairs`.
+    """
+    items = [Mfa_output(utterance_path, voice_path, language=language, device=device, **kwargs) for voice_path, utterance_path in pairs]
+    if not items:
+        return []
+    device = items[0].device
+    sr = mms_models.SAMPLE_RATE
+    # lengths at the model sample rate, from the headers alone
+    lengths = [int(round(audio_io.get_duration(mo.voice_path)*sr)) for mo in items]
+    buckets = _length_buckets(lengths, batch_size, int(max_batch_seconds*sr))
+    logger.info(f"aligning {len(items)} utterances in {len(buckets)} batches")
+
+    for bucket in buckets:
+        waveforms = [items[i]._load_waveform() for i in bucket]
+        emissions = batch_emissions(waveforms, device)
+        for emission, waveform, i in zip(emissions, waveforms, bucket):
+            mo = items[i]
+            words, mms_words = mo._read_words()
+            token_spans = align_emission(emission, mms_words)
+            result = mo._spans_to_result(token_spans, words, emission.size(0), waveform.size(0))
+            columnar.save_file(mo.aligner_output_path, result, logger)
+
+    return [mo.aligner_output_path for mo in items]
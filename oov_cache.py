@@ -0,0 +1,157 @@
+import os
+import json
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import common as com
+
+logger = com.get_logger(__name__)
+
+DEFAULT_SIZE = int(os.environ.get("OOV_CACHE_SIZE", 20000))
+DEFAULT_DB = os.environ.get("OOV_CACHE_DB") or None
+
+
+class LruCache:
+    """
+    Bounded, thread safe LRU of computed values with hit and miss counts.
+    """
+    def __init__(self, maxsize: int = DEFAULT_SIZE):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._data
+
+    def _remember(self, key, value):
+        self._data[key] = value
+        self._data.move_to_end(key)
+        if len(self._data)>self.maxsize:
+            self._data.popitem(last=False)
+
+    def _lookup(self, key):
+        # the caller holds the lock
+        value = self._data.get(key)
+        if value is not None:
+            self._data.move_to_end(key)
+            self.hits += 1
+        return value
+
+    def get(self, key):
+        with self._lock:
+            value = self._lookup(key)
+            if value is None:
+                self.misses += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            if self.maxsize>0:
+                self._remember(key, value)
+        return value
+
+    def stats(self):
+        lookups = self.hits+self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits/lookups, 4) if lookups else 0.0,
+        }
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = 0
+
+
+class OovCache(LruCache):
+    """
+    Bounded LRU cache of the ARPA phones and ratio weights generated for an
+    out of vocabulary (language, word), with an optional SQLite tier that
+    several worker processes can share.
+    """
+    def __init__(self, maxsize: int = DEFAULT_SIZE, db_path: str = None):
+        super().__init__(maxsize)
+        self.db_path = db_path
+        self._db = None
+        self._db_pid = None
+        self.disk_hits = 0
+
+    def _conn(self):
+        # sqlite connections must not be shared with forked children
+        if self._db is None or self._db_pid!=os.getpid():
+            self._db = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS oov (lang TEXT, word TEXT, phones TEXT, PRIMARY KEY (lang, word))")
+            self._db_pid = os.getpid()
+        return self._db
+
+    def get(self, lang: str, word: str):
+        key = (lang, word)
+        with self._lock:
+            value = self._lookup(key)
+            if value is not None:
+                return value
+
+            if self.db_path:
+                row = self._conn().execute("SELECT phones FROM oov WHERE lang=? AND word=?", key).fetchone()
+                if row:
+                    value = tuple(tuple(p) for p in json.loads(row[0]))
+                    self._remember(key, value)
+                    self.disk_hits += 1
+                    return value
+            self.misses += 1
+        return None
+
+    def put(self, lang: str, word: str, phones: list):
+        value = tuple(tuple(p) for p in phones)
+        with self._lock:
+            if self.maxsize>0:
+                self._remember((lang, word), value)
+            if self.db_path:
+                self._conn().execute("INSERT OR REPLACE INTO oov VALUES (?, ?, ?)", (lang, word, json.dumps(value)))
+        return value
+
+    def get_or_compute(self, lang: str, word: str, compute):
+        value = self.get(lang, word)
+        if value is None:
+            value = self.put(lang, word, compute())
+        return value
+
+    def stats(self):
+        lookups = self.hits+self.disk_hits+self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.hits+self.disk_hits)/lookups, 4) if lookups else 0.0,
+        }
+
+    def clear(self):
+        super().clear()
+        self.disk_hits = 0
+
+
+_cache = None
+
+
+def get_cache():
+    global _cache
+    if _cache is None:
+        _cache = OovCache(DEFAULT_SIZE, DEFAULT_DB)
+    return _cache
+
+
+def configure(maxsize: int = DEFAULT_SIZE, db_path: str = None):
+    global _cache
+    _cache = OovCache(maxsize, db_path)
+    logger.info(f"OOV cache of {maxsize} words, persistent tier: {db_path}")
+    return _cache
@@ -0,0 +1,149 @@
+import os
+import sys
+import json
+import mmap
+import struct
+import bisect
+
+MAGIC = b"PHRI"
+VERSION = 1
+# magic, version, number of phones, number of entries, byte length of the phone table
+_HEADER = struct.Struct("<4sIIII")
+VOWELS = ("A", "E", "I", "O", "U")
+
+
+def _pack_key(cur: int, prev: int, nxt: int):
+    return cur << 32 | prev << 16 | nxt
+
+
+def _pad(n: int):
+    return -n % 8
+
+
+def compile_index(json_path: str, index_path: str):
+    """
+    Converts phoneme_ratios.json ({<current>: {<previous>: {<next>: <ratio>}}}) into a binary index:
+    a newline separated table of interned phone names, a sorted uint64 array of packed
+    (current, previous, next) phone ids and the float64 ratios in the same order.
+    """
+    with open(json_path) as f:
+        ratios = json.load(f)
+
+    phone_ids = {}
+    def intern(p):
+        if p not in phone_ids:
+            phone_ids[p] = len(phone_ids)
+        return phone_ids[p]
+
+    entries = []
+    for cur, prevs in ratios.items():
+        # skips the 'Algorithm' and 'Format' description keys
+        if not isinstance(prevs, dict):
+            continue
+        for prev, nxts in prevs.items():
+            for nxt, ratio in nxts.items():
+                entries.append((_pack_key(intern(cur), intern(prev), intern(nxt)), float(ratio)))
+    if len(phone_ids) > 0xFFFF:
+        raise ValueError(f"{len(phone_ids)} phones do not fit in 16 bit phone ids")
+    entries.sort()
+
+    table = "\n".join(phone_ids).encode("utf-8")
+    tmp_path = f"{index_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_HEADER.pack(MAGIC, VERSION, len(phone_ids), len(entries), len(table)))
+        f.write(table)
+        f.write(b"\0"*_pad(_HEADER.size+len(table)))
+        f.write(struct.pack(f"<{len(entries)}Q", *(k for k, _ in entries)))
+        f.write(struct.pack(f"<{len(entries)}d", *(r for _, r in entries)))
+    # atomic so that concurrently starting workers never see a half written index
+    os.replace(tmp_path, index_path)
+    return index_path
+
+
+class PhonemeRatioIndex:
+    """
+    Read only, mmap backed view of a compiled phoneme ratio index. The pages are
+    shared by every process that opens the same file, including forked workers.
+    """
+    def __init__(self, index_path: str):
+        self.index_path = index_path
+        with open(index_path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, n_phones, n_entries, table_len = _HEADER.unpack_from(self._mm, 0)
+        if magic!=MAGIC or version!=VERSION:
+            raise ValueError(f"{index_path} is not a version {VERSION} phoneme ratio index")
+
+        off = _HEADER.size
+        names = self._mm[off:off+table_len].decode("utf-8").split("\n")
+        self.phone_ids = {p: i for i, p in enumerate(names)}
+        off += table_len + _pad(off+table_len)
+        buf = memoryview(self._mm)
+        self._keys = buf[off:off+8*n_entries].cast("Q")
+        off += 8*n_entries
+        self._ratios = buf[off:off+8*n_entries].cast("d")
+
+    def __len__(self):
+        return len(self._keys)
+
+    def lookup(self, cur: str, prev: str, nxt: str, default=None):
+        ids = self.phone_ids
+        if cur not in ids or prev not in ids or nxt not in ids:
+            return default
+        key = _pack_key(ids[cur], ids[prev], ids[nxt])
+        i = bisect.bisect_left(self._keys, key)
+        if i<len(self._keys) and self._keys[i]==key:
+            return self._ratios[i]
+        return default
+
+    def ratio(self, cur: str, prev: str, nxt: str, phone: str = None):
+        """
+        Same as the lookup in Mfa_output._oov: missing (or zero) ratios fall back
+        to 0.5 for vowels and 0.3 for consonants.
+        """
+        ratio = self.lookup(cur, prev, nxt)
+        if not ratio:
+            ratio = 0.5 if (phone or cur).startswith(VOWELS) else 0.3
+        return ratio
+
+    def close(self):
+        self._keys.release()
+        self._ratios.release()
+        self._mm.close()
+
+
+def verify(json_path: str, index_path: str):
+    """
+    Checks that every (current, previous, next) key of the JSON gives an identical ratio from the index.
+    Returns the number of keys checked.
+    """
+    with open(json_path) as f:
+        ratios = json.load(f)
+    index = PhonemeRatioIndex(index_path)
+    n = 0
+    for cur, prevs in ratios.items():
+        if not isinstance(prevs, dict):
+            continue
+        for prev, nxts in prevs.items():
+            for nxt, ratio in nxts.items():
+                got = index.lookup(cur, prev, nxt)
+                if got!=ratio:
+                    raise AssertionError(f"ratio mismatch for {cur} {prev} {nxt}: {got}!={ratio}")
+                expected = ratio or (0.5 if cur.startswith(VOWELS) else 0.3)
+                if index.ratio(cur, prev, nxt)!=expected:
+                    raise AssertionError(f"fallback mismatch for {cur} {prev} {nxt}")
+                n += 1
+    if len(index)!=n:
+        raise AssertionError(f"index has {len(index)} entries, json has {n}")
+    if index.lookup("AA1_S", "-", "<missing>") is not None or index.ratio("AA1_S", "-", "<missing>")!=0.5 \
+            or index.ratio("T_B", "<missing>", "-")!=0.3:
+        raise AssertionError("missing keys do not fall back to the vowel/consonant ratios")
+    index.close()
+    return n
+
+
+if __name__=="__main__":
+    json_path = sys.argv[1] if len(sys.argv)>1 else "phoneme_ratios.json"
+    index_path = sys.argv[2] if len(sys.argv)>2 else os.path.splitext(json_path)[0]+".idx"
+    compile_index(json_path, index_path)
+    print(f"compiled {index_path}, verified {verify(json_path, index_path)} ratios")
@@ -0,0 +1,11 @@
+import pytest
+
+import benchmarks
+import phoneme_index
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_index_matches_json(tmp_path, seed):
+    json_path = benchmarks._stub_ratios(str(tmp_path/"phoneme_ratios.json"), seed=seed)
+    index_path = phoneme_index.compile_index(json_path, str(tmp_path/"phoneme_ratios.idx"))
+    assert phoneme_index.verify(json_path, index_path)>0
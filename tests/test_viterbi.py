@@ -0,0 +1,5 @@
+import benchmarks
+
+
+def test_viterbi_matches_notebook():
+    assert benchmarks.check_viterbi(cases=200)==201
@@ -0,0 +1,256 @@
+import os
+import re
+import bisect
+import string
+import unicodedata
+from concurrent.futures import ProcessPoolExecutor
+
+import common as com
+
+logger = com.get_logger(__name__)
+
+PUNCTS = string.punctuation
+# punctuation that loses the space before it on arrival, and that gets one space after it at the end
+ATTACHED_PUNCTS = "?.,!'\""
+SPACING_PUNCTS = "?.,!"
+EXCEMPTED_CHARACTERS = "'"
+CUSTOM_CONVERSION = {
+    "&": "and",
+    "’": "'",
+}
+HINDI_CONVERSION = {
+    "।": ".",
+    "|": ".",
+}
+MONTHS = {
+    1: "January", 2: "February", 3: "March", 4: "April",
+    5: "May", 6: "June", 7: "July", 8: "August",
+    9: "September", 10: "October", 11: "November", 12: "December"
+}
+DAYS = {
+    1: ["First"], 2: ["Second"], 3: ["Third"], 4: ["Fourth"],
+    5: ["Fifth"], 6: ["Sixth"], 7: ["Seventh"], 8: ["Eighth"],
+    9: ["Nineth"], 10: ["Tenth"], 11: ["Eleventh"], 12: ["Twelfth"],
+    13: ["Thirteenth"], 14: ["Fourteenth"], 15: ["Fifteenth"],
+    16: ["Sixteenth"], 17: ["Seventh"], 18: ["Eighteenth"],
+    19: ["Nineteenth"], 20: ["Twentieth"], 21: ["Twenty", "First"],
+    22: ["Twenty", "Second"], 23: ["Twenty", "Third"],
+    24: ["Twenty", "Fourth"], 25: ["Twenty", "Fifth"],
+    26: ["Twenty", "Sixth"], 27: ["Twenty", "Seventh"],
+    28: ["Twenty", "Eighth"], 29: ["Twenty", "Nineth"],
+    30: ["Thirtieth"], 31: ["Thirty", "First"]
+}
+# (first, last) code points removed as emojis, sorted
+EMOJI_RANGES = [
+    (0x2702, 0x27B0),    # Dingbats
+    (0x24C2, 0x1F251),   # Enclosed characters
+    (0x1F300, 0x1F5FF),  # symbols & pictographs
+    (0x1F600, 0x1F64F),  # emoticons
+    (0x1F680, 0x1F6FF),  # transport & map symbols
+    (0x1F700, 0x1F77F),  # alchemical symbols
+    (0x1F780, 0x1F7FF),  # Geometric Shapes Extended
+    (0x1F800, 0x1F8FF),  # Supplemental Arrows-C
+    (0x1F900, 0x1F9FF),  # Supplemental Symbols and Pictographs
+    (0x1FA00, 0x1FA6F),  # Chess Symbols
+    (0x1FA70, 0x1FAFF),  # Symbols and Pictographs Extended-A
+]
+
+
+def _merge_ranges(ranges: list):
+    merged = []
+    for first, last in sorted(ranges):
+        if merged and first<=merged[-1][1]+1:
+            merged[-1][1] = max(merged[-1][1], last)
+        else:
+            merged.append([first, last])
+    return [f for f, _ in merged], [l for _, l in merged]
+
+
+_EMOJI_FIRST, _EMOJI_LAST = _merge_ranges(EMOJI_RANGES)
+
+
+def _is_emoji(cp: int):
+    i = bisect.bisect_right(_EMOJI_FIRST, cp)-1
+    return i>=0 and cp<=_EMOJI_LAST[i]
+
+
+class _PreTable(dict):
+    """
+    str.translate table of the first pass: custom conversions and emoji removal. Characters are
+    classified on first sight and cached, the table never holds more than the characters seen.
+    """
+    def __init__(self, conversions: dict):
+        super().__init__({ord(k): v for k, v in conversions.items()})
+
+    def __missing__(self, cp: int):
+        v = self[cp] = None if _is_emoji(cp) else cp
+        return v
+
+
+class _AllowedTable(dict):
+    """
+    str.translate table keeping letters, combining marks (the vowel signs of Indic scripts),
+    digits, whitespace and punctuation of any script and turning every other character into a space.
+    """
+    def __missing__(self, cp: int):
+        c = chr(cp)
+        keep = (c.isalpha() or c.isdigit() or not c.strip() or c in PUNCTS or c in EXCEMPTED_CHARACTERS
+                or unicodedata.category(c).startswith("M"))
+        v = self[cp] = cp if keep else " "
+        return v
+
+
+_ALLOWED = _AllowedTable()
+_SPACES = re.compile(r" {2,}")
+# the patterns below match only what is removed or the place of an insertion, literal replacements
+# are much cheaper than group templates
+_SPACE_BEFORE_ATTACHED = re.compile(f" (?=[{re.escape(ATTACHED_PUNCTS)}])")
+# one whitespace in front of a punctuation mark is dropped, unless it starts the utterance
+_WHITESPACE_BEFORE_PUNCT = re.compile(f"(?<=.)\\s(?=[{re.escape(PUNCTS)}])", re.S)
+_SUCCESSIVE_PUNCTS = re.compile(f"(?<=[{re.escape(PUNCTS)}])[{re.escape(PUNCTS)}]+")
+# as in the prototype, a tag does not span lines
+_TAG = re.compile(r"<.*?>")
+_EMAIL = re.compile(r"[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+")
+_DATE = re.compile(r"(\d{1,2})[/.-](\d{1,2})[/.-](\d{2,4})")
+_DIGIT = re.compile(r"\d")
+# a dropped tag with the whitespace around it, the prototype splits the utterance at tags and strips the pieces
+_TAG_SPACE = re.compile(f"\\s*{_TAG.pattern}\\s*")
+# the single tokenizing scan: ssml tags, e-mail addresses and dates, each a whole word apart from the
+# punctuation around it, everything else is left in place. As in the prototype a date is a word
+# between spaces or tags, a newline next to it keeps it from being spelled out.
+_SPECIAL = re.compile(
+    f"(?P<tag>{_TAG.pattern})"
+    f"|(?<![^\\s{re.escape(PUNCTS)}])(?P<email>{_EMAIL.pattern})(?=[{re.escape(PUNCTS)}]?(?:\\s|$))"
+    f"|(?<![^ >])(?P<date>{_DATE.pattern})(?=[{re.escape(PUNCTS)}]?(?: |$|{_TAG.pattern}))"
+)
+
+
+_NOT_UROMAN = re.compile(r"[^a-z' ]")
+
+
+def normalize_uroman(text: str):
+    """
+    Lower cased uroman output reduced to a-z, apostrophes and single spaces.
+    """
+    text = text.lower().replace("’", "'")
+    return _SPACES.sub(" ", _NOT_UROMAN.sub(" ", text)).strip()
+
+
+def _correct_spacing(text: str):
+    for p in SPACING_PUNCTS:
+        text = text.replace(f" {p}", p)
+    for p in SPACING_PUNCTS:
+        text = text.replace(p, f"{p} ")
+    return _SPACES.sub(" ", text).strip()
+
+
+def _expand_date(day: str, month: str, year: str):
+    day, month = int(day), int(month)
+    if day not in DAYS or month not in MONTHS:
+        return None
+    return " ".join(DAYS[day]+[MONTHS[month], year])
+
+
+class TextNormalizer:
+    """
+    Text normalization in front of alignment, from text_processing_testing.ipynb. The prototype's
+    passes over the utterance (pre normalization, custom pronunciations, emoji removal, ssml tag
+    splitting, date and e-mail normalization, character filtering, punctuation clean up) run as
+    translate tables and a few precompiled regexes, with tags, dates and e-mails found in one scan.
+
+    cust_pron: {word: pronunciation} replacements of whole words
+    normalizer: optional text normalizer (e.g. NeMo) with a normalize(text) method, used on e-mails
+    """
+    def __init__(self, lang: str = "english", cust_pron: dict = None, normalizer = None):
+        self.lang = lang.lower()
+        self.cust_pron = dict(cust_pron or {})
+        self.normalizer = normalizer
+        conversions = dict(CUSTOM_CONVERSION)
+        if self.lang=="hindi":
+            conversions.update(HINDI_CONVERSION)
+        self._pre_table = _PreTable(conversions)
+        self._cust_pattern = None
+        # the pronunciations are matched before the conversions, as in the prototype
+        self._cust = dict(self.cust_pron)
+        if self._cust:
+            # longest first so a pronunciation of "New York" wins over one of "New"
+            words = sorted(self._cust, key=len, reverse=True)
+            self._cust_pattern = re.compile(r"\b(?:" + "|".join(re.escape(w) for w in words) + r")\b")
+
+    def __getstate__(self):
+        return {"lang": self.lang, "cust_pron": self.cust_pron, "normalizer": self.normalizer}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def _special(self, m, ssml: bool):
+        if m.group("tag"):
+            return _correct_spacing(m.group("tag")) if ssml else " "
+        if m.group("date"):
+            return _expand_date(*m.group(4, 5, 6)) or m.group(0)
+        w = m.group("email")
+        end = ""
+        # a sentence final full stop is not part of the address
+        if w.endswith("."):
+            w, end = w[:-1], "."
+        if self.normalizer:
+            w = self.normalizer.normalize(w)
+        return w+end
+
+    def normalize(self, utterance: str, ssml: bool = False):
+        """
+        Normalized utterance. ssml tags are kept (with corrected spacing) when `ssml` is set and
+        dropped otherwise; successive punctuation is only collapsed for plain text.
+        """
+        text = _SPACES.sub(" ", utterance)
+        text = _SPACE_BEFORE_ATTACHED.sub("", text)
+        if self._cust_pattern:
+            text = self._cust_pattern.sub(lambda m: self._cust[m.group(0)], text)
+        text = text.translate(self._pre_table)
+        if not ssml:
+            if "<" in text:
+                text = _TAG_SPACE.sub(" ", text)
+            text = text.strip()
+        # most utterances have nothing for the scan to find
+        if "<" in text or "@" in text or _DIGIT.search(text):
+            text = _SPECIAL.sub(lambda m: self._special(m, ssml), text)
+
+        if ssml:
+            # tags keep their characters, only the text between them is filtered
+            parts = _TAG.split(text)
+            tags = _TAG.findall(text)
+            out = [_WHITESPACE_BEFORE_PUNCT.sub("", parts[0].translate(_ALLOWED))]
+            for tag, part in zip(tags, parts[1:]):
+                out.append(tag)
+                out.append(_WHITESPACE_BEFORE_PUNCT.sub("", part.translate(_ALLOWED)))
+            text = "".join(out)
+        else:
+            # the spaces around dropped tags
+            text = _SPACES.sub(" ", text)
+            text = _WHITESPACE_BEFORE_PUNCT.sub("", text.translate(_ALLOWED))
+            text = _SPACES.sub(" ", _SUCCESSIVE_PUNCTS.sub("", text))
+        return _correct_spacing(text)
+
+    def normalize_many(self, utterances: list, ssml: bool = False, workers: int = None, chunksize: int = 256):
+        """
+        Normalizes a batch of utterances, in `workers` processes for large batches.
+        """
+        utterances = list(utterances)
+        workers = workers or 1
+        if workers<=1 or len(utterances)<=chunksize:
+            return [self.normalize(u, ssml) for u in utterances]
+        chunks = [utterances[i:i+chunksize] for i in range(0, len(utterances), chunksize)]
+        with ProcessPoolExecutor(min(workers, len(chunks))) as pool:
+            out = []
+            for res in pool.map(_normalize_chunk, [(self, c, ssml) for c in chunks]):
+                out.extend(res)
+        return out
+
+
+def _normalize_chunk(job: tuple):
+    normalizer, utterances, ssml = job
+    return [normalizer.normalize(u, ssml) for u in utterances]
+
+
+def normalize_many(utterances: list, lang: str = "english", ssml: bool = False, workers: int = None, **kwargs):
+    return TextNormalizer(lang, **kwargs).normalize_many(utterances, ssml, workers or os.cpu_count())
@@ -0,0 +1,107 @@
+import numpy as np
+
+NEG_INF = -np.inf
+
+
+def to_log(p):
+    with np.errstate(divide="ignore"):
+        return np.log(np.asarray(p, dtype=np.float64))
+
+
+def _band_transitions(log_transition: np.ndarray, band: int):
+    """
+    (2*band+1, S) view of the transitions within `band` states: row d holds log_transition[s-o, s]
+    for the offset o = d-band, and -inf where s-o falls outside the states.
+    """
+    n_states = log_transition.shape[0]
+    offsets = np.arange(-band, band+1)
+    prev = np.arange(n_states)[None, :] - offsets[:, None]
+    valid = (prev>=0) & (prev<n_states)
+    out = np.full(prev.shape, NEG_INF)
+    out[valid] = log_transition[prev[valid], np.broadcast_to(np.arange(n_states), prev.shape)[valid]]
+    return offsets, out
+
+
+def _shift(scores: np.ndarray, offsets: np.ndarray):
+    # shifted[..., d, s] = scores[..., s-offsets[d]], -inf outside the states
+    n_states = scores.shape[-1]
+    band = (len(offsets)-1)//2
+    padded = np.full(scores.shape[:-1]+(n_states+2*band,), NEG_INF)
+    padded[..., band:band+n_states] = scores
+    return np.stack([padded[..., band-o:band-o+n_states] for o in offsets], axis=-2)
+
+
+def viterbi_batch(log_emissions: np.ndarray, log_transition: np.ndarray, log_initial: np.ndarray,
+                  lengths=None, band: int=None, beam: float=None):
+    """
+    Log space Viterbi decoding of a batch of sequences.
+
+    log_emissions: (B, T, S) log emission scores of every frame, padded past each sequence's length
+    log_transition: (S, S) log probability of moving from state i to state j
+    log_initial: (S,) log probability of starting in each state
+    lengths: (B,) number of valid frames per sequence, all T when None
+    band: only consider transitions between states at most `band` apart. This is exact when the
+        transitions outside the band are impossible, as in left-to-right alignment models,
+        and costs O(S*band) per frame instead of O(S^2)
+    beam: prune states scoring more than `beam` below the best state of their frame
+
+    Returns the (B, T) int32 best state paths (-1 past each length) and the (B,) best path log scores.
+    Ties go to the lowest state index, as in the probability space prototype.
+    """
+    log_emissions = np.asarray(log_emissions, dtype=np.float64)
+    log_transition = np.asarray(log_transition, dtype=np.float64)
+    n_batch, n_frames, n_states = log_emissions.shape
+    lengths = np.full(n_batch, n_frames) if lengths is None else np.asarray(lengths)
+    if band is not None:
+        offsets, band_trans = _band_transitions(log_transition, band)
+
+    scores = np.asarray(log_initial, dtype=np.float64)[None, :] + log_emissions[:, 0]
+    backpointers = np.zeros((n_frames, n_batch, n_states), dtype=np.int32)
+    states = np.arange(n_states, dtype=np.int32)
+    backpointers[0] = states
+    for t in range(1, n_frames):
+        if beam is not None:
+            scores = np.where(scores>=scores.max(axis=1, keepdims=True)-beam, scores, NEG_INF)
+        if band is None:
+            cand = scores[:, :, None] + log_transition[None]
+            best_prev = cand.argmax(axis=1).astype(np.int32)
+            best = np.take_along_axis(cand, best_prev[:, None, :], axis=1)[:, 0]
+        else:
+            cand = _shift(scores, offsets) + band_trans[None]
+            best_off = cand.argmax(axis=1)
+            best = np.take_along_axis(cand, best_off[:, None, :], axis=1)[:, 0]
+            best_prev = (states[None, :]-offsets[best_off]).astype(np.int32)
+        new_scores = best + log_emissions[:, t]
+
+        active = (t<lengths)[:, None]
+        scores = np.where(active, new_scores, scores)
+        backpointers[t] = np.where(active, best_prev, states[None, :])
+
+    paths = np.full((n_batch, n_frames), -1, dtype=np.int32)
+    last = scores.argmax(axis=1).astype(np.int32)
+    best_scores = scores[np.arange(n_batch), last]
+    batch = np.arange(n_batch)
+    cur = last
+    for t in range(n_frames-1, -1, -1):
+        valid = t<lengths
+        paths[valid, t] = cur[valid]
+        cur = np.where(valid, backpointers[t, batch, cur], cur)
+    return paths, best_scores
+
+
+def viterbi_decode(log_emissions: np.ndarray, log_transition: np.ndarray, log_initial: np.ndarray, **kwargs):
+    """
+    Single sequence version of viterbi_batch, log_emissions is (T, S).
+    """
+    paths, scores = viterbi_batch(np.asarray(log_emissions)[None], log_transition, log_initial, **kwargs)
+    return paths[0], scores[0]
+
+
+def viterbi(obs_indices: list, transition_prob, emission_prob, initial_prob, **kwargs):
+    """
+    Decodes observation indices with probability space HMM parameters, the signature of the
+    prototype in viterbi_algorithm_implementation.ipynb. Returns the best state indices and
+    the log probability of that path.
+    """
+    log_emissions = to_log(emission_prob)[:, np.asarray(obs_indices)].T
+    return viterbi_decode(log_emissions, to_log(transition_prob), to_log(initial_prob), **kwargs)
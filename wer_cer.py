@@ -0,0 +1,184 @@
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import common as com
+from columnar import StringTable
+from text_normalizer import normalize_uroman
+
+logger = com.get_logger(__name__)
+
+KERNELS = ("bitparallel", "numpy")
+# jiwer's wer_default: RemoveMultipleSpaces, Strip, ReduceToListOfListOfWords
+_MULTIPLE_SPACES = re.compile(r"\s\s+")
+
+
+def words(text: str):
+    return [w for w in _MULTIPLE_SPACES.sub(" ", text).strip().split(" ") if w]
+
+
+def chars(text: str):
+    # jiwer's cer_default: Strip, ReduceToListOfListOfChars
+    return list(text.strip())
+
+
+def intern_corpus(references: list, hypotheses: list):
+    """
+    Word id sequences of both sides over one shared vocabulary, as jiwer maps words to
+    integers before computing distances. Characters are compared by code point.
+    """
+    table = StringTable()
+    refs = [[table.intern(w) for w in words(t)] for t in references]
+    hyps = [[table.intern(w) for w in words(t)] for t in hypotheses]
+    return refs, hyps, table
+
+
+def levenshtein(a: list, b: list):
+    """
+    Edit distance of two id sequences with the bit-parallel algorithm of Myers/Hyyrö: one
+    column of the DP matrix is a pair of bit vectors over `a`, updated in a handful of integer
+    operations per element of `b`. Python integers make the vectors as long as needed.
+    """
+    m = len(a)
+    if not m:
+        return len(b)
+    if not b:
+        return m
+    peq = {}
+    for i, t in enumerate(a):
+        peq[t] = peq.get(t, 0) | 1 << i
+    mask = (1 << m)-1
+    high = 1 << (m-1)
+    pv, mv, score = mask, 0, m
+    for t in b:
+        eq = peq.get(t, 0)
+        xv = eq | mv
+        xh = (((eq & pv)+pv) ^ pv) | eq
+        ph = mv | ~(xh | pv)
+        mh = pv & xh
+        if ph & high:
+            score += 1
+        elif mh & high:
+            score -= 1
+        ph = ph << 1 | 1
+        pv = ((mh << 1) | ~(xv | ph)) & mask
+        mv = ph & xv
+    return score
+
+
+def _pad(seqs: list, fill: int):
+    out = np.full((len(seqs), max(1, max(len(s) for s in seqs))), fill, dtype=np.int64)
+    for i, s in enumerate(seqs):
+        out[i, :len(s)] = s
+    return out
+
+
+def levenshtein_batch(refs: list, hyps: list):
+    """
+    Edit distances of many id sequence pairs, one NumPy DP row update per reference position
+    for the whole batch. Insertions along a row are a running minimum of cost-j, plus j.
+    """
+    if not refs:
+        return np.zeros(0, dtype=np.int64)
+    ref_lens = np.array([len(r) for r in refs])
+    hyp_lens = np.array([len(h) for h in hyps])
+    # distinct fills so padding never matches
+    a = _pad(refs, -1)
+    b = _pad(hyps, -2)
+    n_batch, n = b.shape
+    j = np.arange(n+1)
+    prev = np.broadcast_to(j, (n_batch, n+1)).copy()
+    cand = np.empty_like(prev)
+    for i in range(1, int(ref_lens.max())+1):
+        cand[:, 0] = i
+        np.minimum(prev[:, :-1]+(b!=a[:, i-1:i]), prev[:, 1:]+1, out=cand[:, 1:])
+        row = np.minimum.accumulate(cand-j, axis=1)+j
+        # rows of finished references stay at their last value
+        prev = np.where((i<=ref_lens)[:, None], row, prev)
+    return prev[np.arange(n_batch), hyp_lens]
+
+
+def _length_batches(lengths: list, batch_size: int):
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+    return [order[i:i+batch_size] for i in range(0, len(order), batch_size)]
+
+
+def distances(refs: list, hyps: list, kernel: str = "bitparallel", batch_size: int = 256):
+    if kernel=="bitparallel":
+        return np.array([levenshtein(r, h) for r, h in zip(refs, hyps)], dtype=np.int64)
+    if kernel!="numpy":
+        com.RaiseError(ValueError, f"kernel must be one of {', '.join(KERNELS)}, got '{kernel}'", logger)
+    out = np.zeros(len(refs), dtype=np.int64)
+    # length sorted batches keep the padding small
+    for batch in _length_batches([len(r) for r in refs], batch_size):
+        out[batch] = levenshtein_batch([refs[i] for i in batch], [hyps[i] for i in batch])
+    return out
+
+
+def _distances_job(job: tuple):
+    refs, hyps, kernel = job
+    return distances(refs, hyps, kernel)
+
+
+def parallel_distances(refs: list, hyps: list, kernel: str = "bitparallel", workers: int = None, chunksize: int = 2000):
+    workers = workers or 1
+    if workers<=1 or len(refs)<=chunksize:
+        return distances(refs, hyps, kernel)
+    jobs = [(refs[i:i+chunksize], hyps[i:i+chunksize], kernel) for i in range(0, len(refs), chunksize)]
+    with ProcessPoolExecutor(min(workers, len(jobs))) as pool:
+        return np.concatenate(list(pool.map(_distances_job, jobs)))
+
+
+def _rates(errors: np.ndarray, lengths: np.ndarray):
+    # jiwer scores an empty reference by its insertions, which here are all the errors
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(lengths>0, errors/np.maximum(lengths, 1), errors).astype(np.float64)
+
+
+def evaluate(references: list, hypotheses: list, kernel: str = "bitparallel", workers: int = None):
+    """
+    Corpus and per-utterance WER and CER of hypotheses against references, equal to jiwer.wer and
+    jiwer.cer with their default transforms on the whole lists and on every pair.
+    """
+    references, hypotheses = list(references), list(hypotheses)
+    if len(references)!=len(hypotheses):
+        com.RaiseError(ValueError, f"got {len(references)} references and {len(hypotheses)} hypotheses", logger)
+    workers = workers or os.cpu_count()
+
+    ref_words, hyp_words, _ = intern_corpus(references, hypotheses)
+    ref_chars = [[ord(c) for c in chars(t)] for t in references]
+    hyp_chars = [[ord(c) for c in chars(t)] for t in hypotheses]
+    word_errors = parallel_distances(ref_words, hyp_words, kernel, workers)
+    char_errors = parallel_distances(ref_chars, hyp_chars, kernel, workers)
+    n_words = np.array([len(r) for r in ref_words], dtype=np.int64)
+    n_chars = np.array([len(r) for r in ref_chars], dtype=np.int64)
+
+    total_words, total_chars = int(n_words.sum()), int(n_chars.sum())
+    return {
+        "wer": float(word_errors.sum())/total_words if total_words else int(word_errors.sum()),
+        "cer": float(char_errors.sum())/total_chars if total_chars else int(char_errors.sum()),
+        "utterance_wer": _rates(word_errors, n_words).tolist(),
+        "utterance_cer": _rates(char_errors, n_chars).tolist(),
+        "word_errors": word_errors.tolist(),
+        "char_errors": char_errors.tolist(),
+        "reference_words": n_words.tolist(),
+        "reference_chars": n_chars.tolist(),
+    }
+
+
+def romanize_arabic(texts: list, diacritize: bool = True):
+    """
+    The romanization evaluated in WER_AND_CER.ipynb: Mishkal diacritization, uroman and
+    normalize_uroman, over a whole corpus.
+    """
+    import language_resources as lr
+    ur = lr.get_uroman()
+    vocalizer = lr.get_tashkeel() if diacritize else None
+    out = []
+    for text in texts:
+        if vocalizer:
+            text = vocalizer.tashkeel(text)
+        out.append(normalize_uroman(ur.romanize_string(text)))
+    return out